@@ -0,0 +1,261 @@
+import asyncio
+import json
+import os
+import time
+
+from libqtile.log_utils import logger
+
+
+class Service:
+    """A program started along with qtile
+
+    ``after`` lists the names of the services that have to be ready before
+    this one is started. A daemon is ready once ``ready`` returns True, or as
+    soon as it is spawned if there is no ``ready`` check, and is restarted
+    whenever it exits, unless it exits successfully while ``ready`` passes,
+    meaning another instance is already running. A oneshot service is ready
+    when it exits successfully, and is started again up to ``retries`` times
+    if it fails.
+    """
+
+    def __init__(self, name, command, after=(), oneshot=False, ready=None,
+                 ready_timeout=5, retries=3):
+        self.name = name
+        self.command = command
+        self.after = tuple(after)
+        self.oneshot = oneshot
+        self.ready = ready
+        self.ready_timeout = ready_timeout
+        self.retries = retries
+
+
+def socket_exists(path):
+    """Return a ready check waiting for a service to create its socket"""
+    return lambda: os.path.exists(path)
+
+
+def _parent_pid(pid):
+    try:
+        with open('/proc/%d/stat' % pid) as f:
+            # the command name, in parentheses, may contain spaces
+            return int(f.read().rsplit(')', 1)[1].split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class _Child:
+    """A service left running by qtile before it restarted itself
+
+    qtile keeps its pid when it restarts, so the process is still its child,
+    but the event loop doesn't know it and it is waited for by polling.
+    """
+
+    poll_interval = 1
+
+    def __init__(self, pid):
+        self.pid = pid
+        self._returncode = None
+
+    @property
+    def returncode(self):
+        if self._returncode is None:
+            try:
+                pid, status = os.waitpid(self.pid, os.WNOHANG)
+            except ChildProcessError:
+                # reaped by someone else, its status is lost
+                self._returncode = -1
+            else:
+                if pid:
+                    self._returncode = (
+                        os.WEXITSTATUS(status) if os.WIFEXITED(status)
+                        else -os.WTERMSIG(status)
+                    )
+        return self._returncode
+
+    async def wait(self):
+        while self.returncode is None:
+            await asyncio.sleep(self.poll_interval)
+        return self._returncode
+
+
+class Supervisor:
+    """Start services in parallel, in dependency order, and keep them running
+
+    Nothing is awaited by ``start``, so qtile's startup is never blocked. The
+    time each service takes to be ready is logged, along with the time it took
+    for all of them since ``start`` was called. A service exiting unexpectedly
+    is restarted after a delay, doubled on every failure up to
+    ``max_backoff`` seconds, and reset once it has been running for
+    ``stable_time`` seconds.
+
+    qtile restarts by executing itself again, which keeps the services
+    running. Their pids are saved to ``state_path`` whenever they change, so
+    that ``start`` takes them back after a restart instead of starting them
+    again.
+    """
+
+    poll_interval = 0.05
+    # how often a service found already running is checked
+    check_interval = 5
+
+    def __init__(self, services, state_path=None, max_backoff=60,
+                 stable_time=30):
+        self.services = {service.name: service for service in services}
+        self.state_path = state_path
+        self.max_backoff = max_backoff
+        self.stable_time = stable_time
+        self.ready_events = {}
+        self.ready_times = {}
+        # name -> pid of the running services, None once a oneshot succeeded
+        self.pids = {}
+        self._tasks = []
+        self._started = None
+
+    def _set_pid(self, service, pid):
+        if pid is False:
+            del self.pids[service.name]
+        else:
+            self.pids[service.name] = pid
+        if self.state_path is None:
+            return
+        try:
+            with open(self.state_path, 'w') as f:
+                json.dump({'qtile': os.getpid(), 'services': self.pids}, f)
+        except OSError:
+            logger.exception("autostart: unable to save the services to %s",
+                             self.state_path)
+
+    def _load_state(self):
+        """Return the pids saved before qtile restarted"""
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logger.exception("autostart: unable to load the services from %s",
+                             self.state_path)
+            return {}
+        if state.get('qtile') != os.getpid():
+            # saved by another qtile, e.g. of a previous session
+            return {}
+        pids = {}
+        for name, pid in state.get('services', {}).items():
+            if name in self.services and (
+                    pid is None or _parent_pid(pid) == os.getpid()):
+                pids[name] = pid
+        return pids
+
+    def start(self):
+        """Start the services, or take back those left running by a restart"""
+        self._started = time.monotonic()
+        saved = {} if self.state_path is None else self._load_state()
+        # created here to be bound to qtile's event loop on older Pythons
+        self.ready_events = {name: asyncio.Event() for name in self.services}
+        for service in self.services.values():
+            unknown = set(service.after) - set(self.services)
+            if unknown:
+                logger.error("autostart: %s depends on unknown services %s",
+                             service.name, ", ".join(sorted(unknown)))
+                continue
+            if service.name in saved:
+                pid = saved[service.name]
+                if pid is None:
+                    # oneshot, already done
+                    self._set_pid(service, None)
+                    self._set_ready(service, self._started)
+                    continue
+                proc = _Child(pid)
+            else:
+                proc = None
+            self._tasks.append(
+                asyncio.ensure_future(self._supervise(service, proc))
+            )
+
+    async def _supervise(self, service, proc=None):
+        if proc is None:
+            for name in service.after:
+                await self.ready_events[name].wait()
+
+        backoff = 1
+        failures = 0
+        while True:
+            spawned = time.monotonic()
+            if proc is None:
+                try:
+                    proc = await asyncio.create_subprocess_exec(
+                        *service.command,
+                        stdout=asyncio.subprocess.DEVNULL,
+                        stderr=asyncio.subprocess.DEVNULL,
+                    )
+                except OSError as e:
+                    logger.error("autostart: unable to start %s: %s",
+                                 service.name, e)
+                    return
+            self._set_pid(service, proc.pid)
+
+            if service.oneshot:
+                returncode = await proc.wait()
+                if returncode == 0:
+                    self._set_pid(service, None)
+                    self._set_ready(service, spawned)
+                    return
+                self._set_pid(service, False)
+                failures += 1
+                if failures > service.retries:
+                    logger.error("autostart: %s exited with status %d, "
+                                 "giving up after %d attempts", service.name,
+                                 returncode, failures)
+                    return
+            else:
+                if not self.ready_events[service.name].is_set():
+                    await self._wait_ready(service, proc, spawned)
+                returncode = await proc.wait()
+                self._set_pid(service, False)
+                proc = None
+                if (returncode == 0 and service.ready is not None and
+                        service.ready()):
+                    logger.info("autostart: %s is already running",
+                                service.name)
+                    await self._wait_stopped(service)
+                    logger.warning("autostart: %s stopped, starting it again",
+                                   service.name)
+                    backoff = 1
+                    continue
+                if time.monotonic() - spawned > self.stable_time:
+                    backoff = 1
+            proc = None
+
+            logger.warning("autostart: %s exited with status %d, restarting "
+                           "in %ds", service.name, returncode, backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def _wait_stopped(self, service):
+        # the running instance isn't ours, only its ready check tells it left
+        while service.ready():
+            await asyncio.sleep(self.check_interval)
+
+    async def _wait_ready(self, service, proc, spawned):
+        if service.ready is not None:
+            deadline = spawned + service.ready_timeout
+            while not service.ready():
+                if proc.returncode is not None:
+                    return
+                if time.monotonic() > deadline:
+                    logger.warning("autostart: %s not ready after %ds, "
+                                   "starting its dependents anyway",
+                                   service.name, service.ready_timeout)
+                    break
+                await asyncio.sleep(self.poll_interval)
+        self._set_ready(service, spawned)
+
+    def _set_ready(self, service, spawned):
+        now = time.monotonic()
+        self.ready_times[service.name] = now - spawned
+        self.ready_events[service.name].set()
+        logger.info("autostart: %s ready in %.3fs (%.3fs after startup)",
+                    service.name, now - spawned, now - self._started)
+        if len(self.ready_times) == len(self.services):
+            logger.info("autostart: all services ready %.3fs after startup",
+                        now - self._started)
@@ -0,0 +1,357 @@
+"""Benchmark CustomStack without an X server
+
+Replays scripted sessions against a CustomStack attached to in-process
+stand-ins for qtile's group, core object and windows, and reports, for each
+group size, the time spent per layout command, the number of configure calls
+per layout pass and the number of X calls the windows would have issued.
+
+With --sweep, it instead compares qtile's follow_mouse_focus with the
+debounced MouseFocus handler while the pointer sweeps across a split stack.
+
+Run it from the qtile config directory:
+
+    python -m benchmarks.custom_stack --sizes 1 10 100 500
+    python -m benchmarks.custom_stack --sweep --sizes 20
+"""
+
+import argparse
+import time
+from collections import defaultdict
+
+from libqtile import hook
+from libqtile.layout.max import Max
+
+from custom_layouts import custom_stack
+
+
+class Rect:
+    def __init__(self, x, y, width, height):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+
+
+class FakeHandle:
+    def __init__(self, timers, func):
+        self.timers = timers
+        self.func = func
+
+    def cancel(self):
+        self.timers.remove(self)
+
+
+class FakeQtile:
+    def __init__(self):
+        self.current_window = None
+        self.current_screen = None
+        self.x_calls = 0
+        self.timers = []
+        self._drag = False
+
+    def color_pixel(self, color):
+        return int(color.lstrip('#'), 16)
+
+    def call_later(self, delay, func):
+        handle = FakeHandle(self.timers, func)
+        self.timers.append(handle)
+        return handle
+
+    def call_soon(self, func):
+        return self.call_later(0, func)
+
+    def run_timers(self):
+        timers, self.timers = self.timers, []
+        for handle in timers:
+            handle.func()
+
+
+class FakeXWindow:
+    def __init__(self, client):
+        self.client = client
+
+    def set_attribute(self, **kwargs):
+        self.client.qtile.x_calls += 1
+
+
+class FakeClient:
+    """A window that counts the X requests it would send"""
+
+    def __init__(self, qtile, wid):
+        self.qtile = qtile
+        self.wid = wid
+        self.name = 'window %d' % wid
+        self.window = FakeXWindow(self)
+        self.hidden = True
+        self.floating = False
+        self.group = None
+        self.bordercolor = None
+        self.geometry = None
+
+    @property
+    def has_focus(self):
+        return self is self.qtile.current_window
+
+    def place(self, x, y, width, height, borderwidth, bordercolor,
+              above=False, margin=None):
+        self.geometry = (x, y, width, height, borderwidth, margin)
+        self.bordercolor = bordercolor
+        # configure window, send configure notify and set border pixel
+        self.qtile.x_calls += 3
+
+    def focus(self, warp):
+        # set input focus and _NET_ACTIVE_WINDOW
+        self.qtile.x_calls += 2
+
+    def hide(self):
+        self.hidden = True
+        self.qtile.x_calls += 1
+
+    def unhide(self):
+        self.hidden = False
+        self.qtile.x_calls += 1
+
+
+class FakeFloating:
+    def blur(self):
+        pass
+
+
+class FakeGroup:
+    """The subset of libqtile.group._Group used by CustomStack"""
+
+    name = 'bench'
+
+    def __init__(self, layout, screen_rect):
+        self.qtile = FakeQtile()
+        self.windows = []
+        self.screen = screen_rect
+        self.screen_rect = screen_rect
+        self.qtile.current_screen = screen_rect
+        self.floating_layout = FakeFloating()
+        self.layout = layout.clone(self)
+        # like the config, whose Max layout is told about every focus change
+        self.layouts = [self.layout, Max().clone(self)]
+        self.layout_passes = 0
+        self.configure_calls = 0
+
+        configure = self.layout.configure
+
+        def counting_configure(client, screen_rect):
+            self.configure_calls += 1
+            configure(client, screen_rect)
+
+        self.layout.configure = counting_configure
+
+    @property
+    def current_window(self):
+        return self.qtile.current_window
+
+    @current_window.setter
+    def current_window(self, win):
+        self.qtile.current_window = win
+
+    def layout_all(self, warp=False):
+        if self.windows:
+            self.layout_passes += 1
+            self.layout.layout(list(self.windows), self.screen_rect)
+            if self.current_window:
+                self.current_window.focus(warp)
+
+    def focus(self, win, warp=True, force=False):
+        if win is None or win not in self.windows:
+            return
+        self.qtile.current_window = win
+        for each in self.layouts:
+            each.focus(win)
+        self.layout_all(warp)
+
+    def add(self, win):
+        self.windows.append(win)
+        win.group = self
+        for each in self.layouts:
+            each.add(win)
+        self.focus(win)
+
+    def remove(self, win):
+        self.windows.remove(win)
+        had_focus = win is self.qtile.current_window
+        for each in self.layouts:
+            if each is self.layout:
+                nextfocus = each.remove(win)
+            else:
+                each.remove(win)
+        if had_focus:
+            self.qtile.current_window = None
+            nextfocus = nextfocus or self.layout.focus_first()
+            self.focus(nextfocus)
+        else:
+            self.layout_all()
+
+
+def session(size):
+    """Yield (command name, callable) pairs of a typical session"""
+    def open_window(group, wid):
+        return lambda: group.add(FakeClient(group.qtile, wid))
+
+    def layout_cmd(group, name, times=1):
+        def cmd():
+            for _ in range(times):
+                getattr(group.layout, 'cmd_' + name)()
+        return cmd
+
+    def close_window(group):
+        return lambda: group.remove(group.current_window)
+
+    def steps(group):
+        for wid in range(size):
+            yield 'open', open_window(group, wid)
+            if wid == 0:
+                # nothing to shuffle in a one-client stack
+                yield 'shuffle_up', layout_cmd(group, 'shuffle_up')
+        for _ in range(size):
+            yield 'down', layout_cmd(group, 'down')
+        yield 'client_to_next', layout_cmd(group, 'client_to_next')
+        yield 'toggle_split', layout_cmd(group, 'toggle_split')
+        for _ in range(size):
+            yield 'up', layout_cmd(group, 'up')
+        # the current client is the first of its stack
+        yield 'shuffle_up', layout_cmd(group, 'shuffle_up')
+        yield 'next', layout_cmd(group, 'next')
+        # key repeat, handled in one event loop iteration
+        yield 'shuffle_down x10', layout_cmd(group, 'shuffle_down', 10)
+        yield 'rotate', layout_cmd(group, 'rotate')
+        yield 'toggle_split', layout_cmd(group, 'toggle_split')
+        yield 'client_to_previous', layout_cmd(group, 'client_to_previous')
+        for _ in range(size):
+            yield 'close', close_window(group)
+
+    return steps
+
+
+def check_index(layout):
+    """Check the client index against the clients of the stacks"""
+    expected = {
+        client: (stack, pos)
+        for stack in layout.stacks for pos, client in enumerate(stack.clients)
+    }
+    if layout.state.client_index != expected:
+        raise AssertionError('client index out of sync: %r != %r' % (
+            layout.state.client_index, expected))
+
+
+def run(size, repeat, screen_width=1920, **layout_config):
+    group = None
+    timings = defaultdict(list)
+    totals = dict(layout_passes=0, configure_calls=0, x_calls=0)
+    for _ in range(repeat):
+        group = FakeGroup(custom_stack.CustomStack(**layout_config),
+                          Rect(0, 24, screen_width, 1056))
+        for name, step in session(size)(group):
+            start = time.perf_counter()
+            step()
+            # the event loop then runs the callbacks scheduled by the step
+            group.qtile.run_timers()
+            timings[name].append(time.perf_counter() - start)
+            check_index(group.layout)
+        totals['layout_passes'] += group.layout_passes
+        totals['configure_calls'] += group.configure_calls
+        totals['x_calls'] += group.qtile.x_calls
+    return group, timings, {k: v / repeat for k, v in totals.items()}
+
+
+def sweep(size, repeat, **layout_config):
+    """Time a pointer sweep across a split stack of size clients
+
+    Returns the mean time, X calls and layout passes per sweep, for qtile's
+    follow_mouse_focus and for the debounced MouseFocus handler.
+    """
+    layout_config = dict(layout_config, num_stacks=1, autosplit=[True])
+    results = {}
+    for mode in ('follow_mouse_focus', 'MouseFocus'):
+        if mode == 'MouseFocus':
+            mouse_focus = custom_stack.MouseFocus()
+        elapsed = x_calls = passes = 0
+        for _ in range(repeat):
+            group = FakeGroup(custom_stack.CustomStack(**layout_config),
+                              Rect(0, 24, 1920, 1056))
+            for wid in range(size):
+                group.add(FakeClient(group.qtile, wid))
+            clients = group.layout.stacks[0].clients
+            group.focus(clients[0])
+            group.qtile.x_calls = 0
+            group.layout_passes = 0
+            start = time.perf_counter()
+            for client in clients:
+                hook.fire('client_mouse_enter', client)
+                if (mode == 'follow_mouse_focus' and
+                        group.current_window is not client):
+                    group.focus(client, False)
+            # the pointer stops on the last window
+            group.qtile.run_timers()
+            elapsed += time.perf_counter() - start
+            x_calls += group.qtile.x_calls
+            passes += group.layout_passes
+        results[mode] = (elapsed / repeat, x_calls / repeat, passes / repeat)
+    hook.unsubscribe.client_mouse_enter(mouse_focus._enter)
+    return results
+
+
+def report_sweep(size, results):
+    print('pointer sweep across %d clients of a split stack:' % size)
+    for mode, (elapsed, x_calls, passes) in results.items():
+        print('  %-20s %10.1f us/sweep %8.1f X calls/sweep %6.1f passes/sweep'
+              % (mode, elapsed * 1e6, x_calls, passes))
+
+
+def report(size, group, timings, totals):
+    passes = totals['layout_passes'] or 1
+    print('%d clients: %d layout passes, %.1f configure calls/pass, '
+          '%.1f X calls/pass' % (
+              size, totals['layout_passes'],
+              totals['configure_calls'] / passes,
+              totals['x_calls'] / passes))
+    for name, samples in sorted(timings.items()):
+        print('  %-20s %5d calls %10.1f us/call' % (
+            name, len(samples), sum(samples) / len(samples) * 1e6))
+    if group.layout.instrument:
+        stats = group.layout.cmd_stats()
+        print('  layout stats of the last replay:')
+        for name, timing in sorted(stats['timings'].items()):
+            print('    %-20s %5d calls %8.3f ms mean %8.3f ms p99' % (
+                name, timing['count'], timing['mean_ms'], timing['p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1, 10, 50, 100, 250, 500],
+                        help='numbers of clients to benchmark')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times each session is replayed')
+    parser.add_argument('--autosplit', action='store_true',
+                        help='split all stacks vertically')
+    parser.add_argument('--stacks', type=int, default=2,
+                        help='maximum number of stacks')
+    parser.add_argument('--screen-width', type=int, default=1920,
+                        help='width of the screen in pixels')
+    parser.add_argument('--instrument', action='store_true',
+                        help="also report the layout's own statistics")
+    parser.add_argument('--sweep', action='store_true',
+                        help='time focus changes of a pointer sweep instead')
+    args = parser.parse_args()
+
+    layout_config = dict(border_width=2, margin=8, max_single=True,
+                         autosplit=[args.autosplit] * args.stacks,
+                         num_stacks=args.stacks,
+                         instrument=args.instrument)
+    for size in args.sizes:
+        if args.sweep:
+            report_sweep(size, sweep(size, args.repeat, **layout_config))
+        else:
+            report(size, *run(size, args.repeat, args.screen_width,
+                              **layout_config))
+
+
+if __name__ == '__main__':
+    main()
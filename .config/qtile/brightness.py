@@ -0,0 +1,151 @@
+import asyncio
+import os
+
+from libqtile.log_utils import logger
+
+
+class Backlight:
+    """Change the screen backlight from within qtile's event loop
+
+    The brightness is written directly to the sysfs node of the backlight
+    ``device``, the first one found in ``sysfs_root`` by default, instead of
+    spawning brightnessctl on every key press. Changes requested within
+    ``coalesce_delay`` seconds of each other are added up, and the brightness
+    then moves to the target in ``ramp_time`` seconds, 0 to jump to it at once.
+    If the node isn't writable (brightnessctl's udev rule gives write access to
+    the video group), brightnessctl is spawned once per change instead.
+
+    Functions added with ``add_listener`` are called with the new brightness
+    percentage after every change, e.g. to update a bar widget.
+    """
+
+    def __init__(self, device=None, sysfs_root='/sys/class/backlight',
+                 coalesce_delay=0.02, ramp_time=0.15, ramp_interval=1 / 60):
+        self.sysfs_root = sysfs_root
+        self.device = device
+        self.coalesce_delay = coalesce_delay
+        self.ramp_time = ramp_time
+        self.ramp_interval = ramp_interval
+        self.listeners = []
+        self.max_brightness = None
+        # raw brightness last written, and the one to reach
+        self.value = None
+        self.target = None
+        self._handle = None
+        self._ramp = []
+        self._ramp_handle = None
+        self._writable = True
+        self._missing = False
+
+    def _path(self, name):
+        return os.path.join(self.sysfs_root, self.device, name)
+
+    def _read(self, name):
+        with open(self._path(name)) as f:
+            return int(f.read())
+
+    def _setup(self):
+        if self.max_brightness is not None:
+            return True
+        if self._missing:
+            return False
+        try:
+            if self.device is None:
+                self.device = sorted(os.listdir(self.sysfs_root))[0]
+            self.max_brightness = self._read('max_brightness')
+            self.value = self._read('actual_brightness')
+        except (OSError, IndexError, ValueError):
+            logger.warning("No usable backlight in %s", self.sysfs_root)
+            self._missing = True
+            return False
+        return True
+
+    @property
+    def percent(self):
+        if not self._setup():
+            return None
+        return round(self.value * 100 / self.max_brightness)
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def change(self, step):
+        """Change the brightness by step percents of the maximum"""
+        if not self._setup():
+            return
+        if self.target is not None:
+            base = self.target
+        elif self._ramp:
+            base = self._ramp[-1]
+        else:
+            base = self.value
+        self._request(base + step * self.max_brightness / 100)
+
+    def set(self, percent):
+        if not self._setup():
+            return
+        self._request(percent * self.max_brightness / 100)
+
+    def _request(self, value):
+        self.target = max(0, min(round(value), self.max_brightness))
+        if self._handle is None:
+            loop = asyncio.get_event_loop()
+            self._handle = loop.call_later(self.coalesce_delay, self._flush)
+
+    def _flush(self):
+        self._handle = None
+        target, self.target = self.target, None
+        if target is None or target == self.value:
+            return
+        if self._ramp_handle is not None:
+            # ramp from the current value to the new target instead
+            self._ramp_handle.cancel()
+            self._ramp_handle = None
+        steps = int(self.ramp_time / self.ramp_interval) if self._writable else 0
+        start = self.value
+        # intermediate values, the last one being the target
+        self._ramp = [
+            start + (target - start) * i // steps for i in range(1, steps)
+        ] + [target]
+        self._step()
+
+    def _step(self):
+        self._ramp_handle = None
+        if not self._writable:
+            # no ramping through brightnessctl, go to the target
+            del self._ramp[:-1]
+        self._write(self._ramp.pop(0))
+        if self._ramp:
+            self._ramp_handle = asyncio.get_event_loop().call_later(
+                self.ramp_interval, self._step
+            )
+
+    def _write(self, value):
+        if self._writable:
+            try:
+                with open(self._path('brightness'), 'w') as f:
+                    f.write(str(value))
+            except PermissionError:
+                logger.warning("%s isn't writable, using brightnessctl",
+                               self._path('brightness'))
+                self._writable = False
+                if self._ramp:
+                    value = self._ramp[-1]
+                    self._ramp = []
+        if not self._writable:
+            asyncio.ensure_future(self._brightnessctl(value))
+        self.value = value
+        percent = self.percent
+        for callback in self.listeners:
+            callback(percent)
+
+    async def _brightnessctl(self, value):
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                'brightnessctl', '--quiet', '--device', self.device, 'set',
+                str(value),
+            )
+        except OSError:
+            logger.error("Unable to run brightnessctl")
+            return
+        await proc.wait()
@@ -1,19 +1,174 @@
+import startup_trace
+startup_trace.begin('config import')
+
 import os
-import subprocess
+import socket
+import libqtile
 from libqtile import hook
 
-from libqtile.config import Key, Screen, Group, Drag, Click
+from libqtile.config import Key, Group, Drag, Click, ScratchPad
 from libqtile.lazy import lazy
-from libqtile import layout, bar, widget
+from libqtile.log_utils import logger
+from libqtile.utils import send_notification
+from libqtile import layout, widget
 
 from typing import List  # noqa: F401
 
-from custom_layouts import custom_stack
+import autostart
+import brightness
+import spawn_pool
+import wallpaper
+from custom_layouts import custom_stack, floating
+from custom_widgets import bar as custom_bar
+from custom_widgets import clock, keyboardlayout, prompt, volume, windowname
+
+##############################################################################
+
+# AUTOSTART
 
-@hook.subscribe.startup_once
-def autostart():
-    home = os.path.expanduser('~')
-    subprocess.call([home + '/.config/qtile/autostart.sh'])
+home = os.path.expanduser('~')
+runtime_dir = os.environ.get('XDG_RUNTIME_DIR', '/tmp')
+
+# The services running are saved here, so that they are supervised again after
+# a restart instead of being started twice
+services_state = os.path.join(runtime_dir, 'qtile-services.json')
+
+services = autostart.Supervisor([
+    autostart.Service('picom', ['picom']),
+    autostart.Service('volctl', ['volctl', 'daemon'],
+                      ready=autostart.socket_exists(
+                          os.path.join(runtime_dir, 'volctl.sock'))),
+    autostart.Service('redshift', ['redshift-gtk']),
+    autostart.Service('xbanish', ['xbanish', '-i', 'lock', '-i', 'control',
+                                  '-i', 'mod1', '-i', 'mod4']),
+], state_path=services_state)
+
+@hook.subscribe.startup
+def start_services():
+    services.start()
+
+##############################################################################
+
+# VOLUME CONTROL
+
+def volctl(*command):
+    """Send a command to the volctl daemon from within qtile
+
+    Talking to the daemon socket directly avoids starting a new Python
+    interpreter on every keypress. If the daemon is not running, the volctl
+    script is spawned instead.
+    """
+    message = (' '.join(command) + '\n').encode()
+
+    def _volctl(qtile):
+        runtime_dir = os.environ.get('XDG_RUNTIME_DIR', '/tmp')
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.settimeout(0.1)
+                s.connect(os.path.join(runtime_dir, 'volctl.sock'))
+                s.sendall(message)
+        except OSError:
+            qtile.cmd_spawn(['volctl', *command])
+
+    return lazy.function(_volctl)
+
+##############################################################################
+
+# BRIGHTNESS
+
+backlight = brightness.Backlight()
+
+def brightness_step(step):
+    """Change the backlight from within qtile, without spawning brightnessctl"""
+    return lazy.function(lambda qtile: backlight.change(step))
+
+##############################################################################
+
+# PROMPT
+
+def spawncmd(qtile):
+    """Prompt for a command in the bar of the current screen"""
+    qtile.cmd_spawncmd(widget='prompt%d' % qtile.current_screen.index)
+
+##############################################################################
+
+# SPAWN POOLS
+
+# Windows of the most used applications are kept ready in the hidden 'pool'
+# group, so that they show up right away
+terminal_pool = spawn_pool.SpawnPool('alacritty', size=2, wm_class='Alacritty',
+                                     max_idle_rss=200)
+spawn_pools = [terminal_pool]
+
+@hook.subscribe.startup_complete
+def fill_spawn_pools():
+    for pool in spawn_pools:
+        pool.fill(libqtile.qtile)
+
+##############################################################################
+
+# RESTART
+
+# The stacks of the layouts are saved here before restarting, so that windows
+# keep their place and are laid out once per group after the restart
+stacks_state = os.path.join(runtime_dir, 'qtile-stacks.json')
+
+def config_signature():
+    """Return the modification times of the files making up the config"""
+    config_dir = os.path.dirname(os.path.abspath(__file__))
+    signature = []
+    for root, dirs, files in os.walk(config_dir):
+        dirs[:] = [d for d in dirs if d != '__pycache__']
+        for name in files:
+            if name.endswith('.py'):
+                path = os.path.join(root, name)
+                signature.append((path, os.stat(path).st_mtime_ns))
+    return sorted(signature)
+
+loaded_config = config_signature()
+
+def restart(qtile):
+    requested = startup_trace.now()
+    # the config was checked when it was loaded, only import it again to
+    # validate it if it changed since, like cmd_restart
+    if config_signature() != loaded_config:
+        try:
+            qtile.config.load()
+        except Exception as error:
+            logger.error("Preventing restart because of a configuration "
+                         "error: %s", error)
+            send_notification("Configuration error", str(error.__context__))
+            return
+    # only saved when restarting, the file is read by the next startup
+    custom_stack.save_state(qtile.groups, stacks_state)
+    # set last, the programs spawned by qtile would inherit it
+    startup_trace.mark_restart(requested)
+    qtile.restart()
+
+@hook.subscribe.startup
+def begin_restore_stacks():
+    custom_stack.begin_restore(libqtile.qtile.groups, stacks_state)
+
+@hook.subscribe.startup_complete
+def end_restore_stacks():
+    custom_stack.end_restore(libqtile.qtile.groups)
+
+##############################################################################
+
+# STARTUP TRACE
+
+@hook.subscribe.addgroup
+def trace_group(name):
+    startup_trace.mark('group %s configured' % name)
+
+@hook.subscribe.startup
+def trace_startup():
+    startup_trace.mark('screens configured')
+
+@hook.subscribe.startup_complete
+def trace_startup_complete():
+    startup_trace.mark('startup complete')
+    startup_trace.write()
 
 ##############################################################################
 
@@ -51,8 +206,8 @@ keys = [
     Key([mod], "q", lazy.window.kill()),
 
     # Launch applications
-    Key([mod], "r", lazy.spawncmd()),
-    Key([mod], "t", lazy.spawn("alacritty")),
+    Key([mod], "r", lazy.function(spawncmd)),
+    Key([mod], "t", lazy.function(terminal_pool.claim)),
     Key([mod], "b", lazy.spawn("firefox")),
 
     # Cycle through different layouts
@@ -60,39 +215,39 @@ keys = [
     Key([mod, "shift"], "Tab", lazy.prev_layout()),
 
     # Restart Qtile and log off
-    Key([mod, "shift"], "r", lazy.restart()),
+    Key([mod, "shift"], "r", lazy.function(restart)),
     Key([mod, "shift"], "q", lazy.shutdown()),
 
     # Function keys
     Key(
         [],
         "XF86AudioMute",
-        lazy.spawn("volctl toggle")
+        volctl("toggle")
     ),
     Key(
         [],
         "XF86AudioRaiseVolume",
-        lazy.spawn("volctl set +5")
+        volctl("set", "+5")
     ),
     Key(
         [],
         "XF86AudioLowerVolume",
-        lazy.spawn("volctl set -5")
+        volctl("set", "-5")
     ),
     Key(
         [],
         "XF86AudioMicMute",
-        lazy.spawn("amixer set Capture toggle")
+        volctl("toggle-mic")
     ),
     Key(
         [],
         "XF86MonBrightnessDown",
-        lazy.spawn("brightnessctl set 10%-")
+        brightness_step(-10)
     ),
     Key(
         [],
         "XF86MonBrightnessUp",
-        lazy.spawn("brightnessctl set +10%")
+        brightness_step(+10)
     ),
 ]
 
@@ -119,6 +274,9 @@ for g in groups:
         #     lazy.window.togroup(g.name)),
     ])
 
+# Hidden group of the spawn pools
+groups.append(ScratchPad('pool'))
+
 ##############################################################################
 
 # COLORS
@@ -168,6 +326,8 @@ layouts = [
         border_width=2,
         margin=8,
         max_single=True,
+        # more columns on ultrawide screens
+        stacks_by_width=[(3440, 3), (5120, 4)],
     ),
 
     # layout.MonadTall(
@@ -193,77 +353,96 @@ widget_defaults = dict(
 )
 extension_defaults = widget_defaults.copy()
 
+def make_bar(index, systray=False):
+    """Return the top bar of the screen index, one is built per screen
+
+    The volume, keyboard layout, clock and window name widgets are views of
+    data sources shared by all the bars, so another screen doesn't add any
+    polling or subprocess. The prompt is named after the screen, so that it
+    opens where the focus is.
+    """
+    return custom_bar.Bar(
+        [
+            # widget.CurrentLayout(foreground=colors['blueGrey100']),
+
+            widget.CurrentLayoutIcon(scale=0.75),
+
+            widget.GroupBox(
+                # Active groups (at least one client open) font color
+                active=colors['blueGrey100'],
+
+                foreground=colors['blueGrey100'],
+
+                # Current group highlight color, here,
+                # it is set the same as the bar color
+                highlight_color=[colors['blueGrey900'],
+                                 colors['blueGrey900']],
+
+                highlight_method='line',
+
+                # Inactive groups font color
+                inactive=colors['blueGrey500'],
+
+                # Text vertical alignment
+                margin=5,
+
+                padding=0,
+
+                # Current group in current screen line color
+                this_current_screen_border=colors['cyan500'],
+            ),
+
+            prompt.Prompt(name='prompt%d' % index,
+                          foreground=colors['blueGrey100']),
+
+            windowname.WindowName(
+                font='Noto Sans Bold',
+                foreground=colors['blueGrey200'],
+            ),
+
+            # there can be only one system tray
+            *([widget.Systray()] if systray else []),
+
+            widget.Spacer(2),
+
+            volume.Volume(
+                step=5,
+                foreground=colors['blueGrey100'],
+            ),
+
+            keyboardlayout.KeyboardLayout(
+                configured_keyboards=['us intl', 'us altgr-intl'],
+                # changes made from the widget are shown right away, look
+                # for the other ones on every 10th second of the clock
+                update_interval=10,
+                foreground=colors['blueGrey100'],
+            ),
+
+            clock.Clock(
+                format='%a %d/%m, %H:%M',
+                foreground=colors['blueGrey100'],
+            ),
+
+            widget.QuickExit(
+                default_text='⏻',
+                fontsize=16,
+                foreground=colors['blueGrey100'],
+            ),
+        ],
+        size=24,
+        background=colors['blueGrey900'],
+        opacity=0.95,
+    )
+
+# Screens beyond the connected monitors are left unused. The wallpaper is
+# scaled once per screen size and then painted from the cache
 screens = [
-    Screen(
-        top=bar.Bar(
-            [
-                # widget.CurrentLayout(foreground=colors['blueGrey100']),
-
-                widget.CurrentLayoutIcon(scale=0.75),
-
-                widget.GroupBox(
-                    # Active groups (at least one client open) font color
-                    active=colors['blueGrey100'],
-
-                    foreground=colors['blueGrey100'],
-
-                    # Current group highlight color, here,
-                    # it is set the same as the bar color
-                    highlight_color=[colors['blueGrey900'],
-                                     colors['blueGrey900']],
-
-                    highlight_method='line',
-
-                    # Inactive groups font color
-                    inactive=colors['blueGrey500'],
-
-                    # Text vertical alignment
-                    margin=5,
-
-                    padding=0,
-
-                    # Current group in current screen line color
-                    this_current_screen_border=colors['cyan500'],
-                ),
-
-                widget.Prompt(foreground=colors['blueGrey100']),
-
-                widget.WindowName(
-                    font='Noto Sans Bold',
-                    foreground=colors['blueGrey200'],
-                ),
-
-                widget.Systray(),
-
-                widget.Spacer(2),
-
-                widget.Volume(
-                    step=5,
-                    update_interval=0.1,
-                    foreground=colors['blueGrey100'],
-                ),
-
-                widget.KeyboardLayout(
-                    configured_keyboards=['us intl', 'us altgr-intl'],
-                    foreground=colors['blueGrey100'],
-                ),
-
-                widget.Clock(
-                    format='%a %d/%m, %H:%M',
-                    foreground=colors['blueGrey100'],
-                ),
-
-                widget.QuickExit(
-                    default_text='⏻',
-                    fontsize=16,
-                    foreground=colors['blueGrey100'],
-                ),
-            ],
-            size=24,
-            background=colors['blueGrey900'],
-            opacity=0.95,
-        ),
-    ),
+    wallpaper.Screen(
+        top=make_bar(i, systray=i == 0),
+        wallpaper=home + '/.config/qtile/wallpapers/adapta.jpg',
+        wallpaper_mode='fill',
+    )
+    for i in range(3)
 ]
 
 ##############################################################################
@@ -280,12 +459,16 @@ mouse = [
 dgroups_key_binder = None
 dgroups_app_rules = []  # type: List
 main = None
-follow_mouse_focus = True
+# Focus follows mouse is handled by MouseFocus, which waits for the pointer to
+# settle on a window and only repaints borders when no window has to move
+follow_mouse_focus = False
+mouse_focus = custom_stack.MouseFocus(settle_time=0.05)
 bring_front_click = False
 cursor_warp = False
-floating_layout = layout.Floating(
+floating_layout = floating.Floating(
     float_rules=[
         # Run the utility of `xprop` to see the wm class and name of an X client.
+        # Values may also be compiled regular expressions.
         {'wmclass': 'confirm'},
         {'wmclass': 'dialog'},
         {'wmclass': 'download'},
@@ -316,3 +499,5 @@ focus_on_window_activation = "smart"
 # We choose LG3D to maximize irony: it is a 3D non-reparenting WM written in
 # java that happens to be on java's whitelist.
 wmname = "LG3D"
+
+startup_trace.end('config import')
@@ -1,5 +1,93 @@
-from libqtile import utils
-from libqtile.layout.base import Layout, _ClientList
+import functools
+import json
+import math
+import os
+import time
+from collections import deque
+
+from libqtile import hook, utils
+from libqtile.layout.base import Layout, _ClientList, _SimpleLayoutBase
+from libqtile.log_utils import logger
+
+# bumped whenever a window title changes, as info() shows client names
+_name_changes = 0
+
+
+@hook.subscribe.client_name_updated
+def _client_name_updated(client):
+    global _name_changes
+    _name_changes += 1
+
+
+class _Stats:
+    """Call counts and timings of the layout hot paths"""
+
+    X_CALLS = ("place", "hide", "unhide", "border")
+
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self.reset()
+
+    def reset(self):
+        # name -> [count, cumulative time, recent durations]
+        self.timings = {}
+        self.passes = 0
+        self.pass_x_calls = dict.fromkeys(self.X_CALLS, 0)
+        self.max_pass_x_calls = dict.fromkeys(self.X_CALLS, 0)
+
+    def record(self, name, duration):
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = self.timings[name] = [0, 0.0, deque(maxlen=self.samples)]
+        timing[0] += 1
+        timing[1] += duration
+        timing[2].append(duration)
+
+    def record_pass(self, before, after):
+        self.passes += 1
+        for name in self.X_CALLS:
+            calls = after[name] - before[name]
+            self.pass_x_calls[name] += calls
+            if calls > self.max_pass_x_calls[name]:
+                self.max_pass_x_calls[name] = calls
+
+    def info(self):
+        timings = {}
+        for name, (count, total, recent) in self.timings.items():
+            recent = sorted(recent)
+            timings[name] = dict(
+                count=count,
+                total_ms=total * 1e3,
+                mean_ms=total / count * 1e3,
+                p99_ms=recent[max(0, math.ceil(0.99 * len(recent)) - 1)] * 1e3,
+            )
+        passes = self.passes or 1
+        return dict(
+            timings=timings,
+            layout_passes=self.passes,
+            x_calls_per_pass={
+                name: dict(mean=self.pass_x_calls[name] / passes,
+                           max=self.max_pass_x_calls[name])
+                for name in self.X_CALLS
+            },
+        )
+
+
+def _timed(method):
+    """Record the duration of method calls when instrumentation is enabled"""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.instrument:
+            return method(self, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.stats.record(name, time.perf_counter() - start)
+
+    return wrapper
 
 
 class _WinStack(_ClientList):
@@ -7,13 +95,55 @@ class _WinStack(_ClientList):
     # shortcuts for current client and index used in Columns layout
     cw = _ClientList.current_client
 
-    def __init__(self, autosplit=False):
+    def __init__(self, autosplit=False, index=None):
         _ClientList.__init__(self)
         self.split = autosplit
+        # client -> (stack, position) mapping shared with the layout
+        self._index = {} if index is None else index
+
+    def _reindex(self, start=0, stop=None):
+        for pos, client in enumerate(self.clients[start:stop], start):
+            self._index[client] = (self, pos)
 
     def toggle_split(self):
         self.split = False if self.split else True
 
+    def add(self, client, offset_to_current=0):
+        pos = min(max(0, self._current_idx + offset_to_current), len(self))
+        _ClientList.add(self, client, offset_to_current)
+        self._reindex(pos)
+
+    def remove(self, client):
+        if client not in self:
+            return
+        _, idx = self._index.pop(client)
+        del self.clients[idx]
+        if len(self) == 0:
+            self._current_idx = 0
+        elif idx <= self._current_idx:
+            self._current_idx = max(0, self._current_idx - 1)
+        self._reindex(idx)
+
+    def shuffle_up(self, maintain_index=True):
+        idx = self._current_idx
+        _ClientList.shuffle_up(self, maintain_index)
+        self._reindex(max(idx - 1, 0), idx + 1)
+
+    def shuffle_down(self, maintain_index=True):
+        idx = self._current_idx
+        _ClientList.shuffle_down(self, maintain_index)
+        self._reindex(idx, idx + 2)
+
+    def focus(self, client):
+        self._current_idx = self._index[client][1]
+
+    def index(self, client):
+        return self._index[client][1]
+
+    def __contains__(self, client):
+        entry = self._index.get(client)
+        return entry is not None and entry[0] is self
+
     def __str__(self):
         return "_WinStack: %s, %s" % (
             self.cw, str([client.name for client in self.clients])
@@ -25,12 +155,65 @@ class _WinStack(_ClientList):
         return info
 
 
+class _LayoutState:
+    """Mutable per-group state of a CustomStack
+
+    The configuration stays in the layout instance, which is a shallow copy of
+    the template layout and shares its config dicts, so cloning a layout for a
+    new group only has to allocate one of these.
+    """
+
+    __slots__ = (
+        "stacks",
+        "client_index",
+        "version",
+        "plan",
+        "plan_key",
+        "px_focus",
+        "px_normal",
+        "applied",
+        "x_calls",
+        "info",
+        "info_key",
+        "restore",
+        "restored",
+        "relayout",
+        "last_layout",
+    )
+
+    def __init__(self):
+        self.stacks = []
+        # client -> (stack, position)
+        self.client_index = {}
+        # bumped on every change that may affect the placement of clients
+        self.version = 0
+        self.plan = {}
+        self.plan_key = None
+        self.px_focus = None
+        self.px_normal = None
+        self.reset_damage()
+        self.info = None
+        self.info_key = None
+        # snapshot being restored and clients added in the meantime
+        self.restore = None
+        self.restored = []
+        # pending layout pass requested by commands, and time of the last one
+        self.relayout = None
+        self.last_layout = 0
+
+    def reset_damage(self):
+        # client -> (placement, border pixel) last applied, None if hidden
+        self.applied = {}
+        self.x_calls = dict.fromkeys(_Stats.X_CALLS + ("skipped",), 0)
+
+
 class CustomStack(Layout):
-    """A layout composed of at most two stacks of windows
+    """A layout composed of a few stacks of windows
 
-    This custom stack layout distributes the windows in at most two
-    horizontally splitted stacks. Stacks are created as needed, always taking
-    the whole screen space. Each pane can be set to autosplit vertically,
+    This custom stack layout distributes the windows in horizontally splitted
+    stacks, two by default, or more on wide screens as set by
+    ``stacks_by_width``. Stacks are created as needed, always taking the whole
+    screen space. Each pane can be set to autosplit vertically,
     instead of stacking its clients. When closing all the windows in a stack,
     the other pane will take up the whole screen if not set to autosplit (or if
     there is only one client in it), otherwise, the last focused window will
@@ -44,16 +227,35 @@ class CustomStack(Layout):
         ("border_normal", "#000000", "Border colour for un-focused windows."),
         ("border_width", 1, "Border width."),
         ("name", "customstack", "Name of this layout."),
-        ("autosplit", [False, False], "Auto split left and right stacks."),
+        ("autosplit", [False, False], "Auto split each stack, from left to "
+                                      "right. Missing values mean False."),
+        ("num_stacks", 2, "Maximum number of stacks."),
+        ("stacks_by_width", [], "List of (min_screen_width, num_stacks) "
+                                "pairs overriding num_stacks on wide screens."),
         ("fair", False, "Add new windows to the stacks in a round robin way."),
         ("margin", 0, "Margin of the layout."),
         ("max_single", False, "Remove margins if there is only one stack."),
+        ("layout_interval", 0, "Minimum time between two layout passes "
+                               "requested by commands, in seconds. With 0, "
+                               "the commands handled in the same event loop "
+                               "iteration share one layout pass."),
+        ("instrument", False, "Collect call counts and timings of the layout "
+                              "operations, readable with the stats command."),
     ]
 
     def __init__(self, **config):
         Layout.__init__(self, **config)
         self.add_defaults(CustomStack.defaults)
-        self.stacks = []
+        self.state = _LayoutState()
+        self.stats = _Stats()
+
+    @property
+    def stacks(self):
+        return self.state.stacks
+
+    @property
+    def x_calls(self):
+        return self.state.x_calls
 
     @property
     def current_stack(self):
@@ -61,10 +263,10 @@ class CustomStack(Layout):
 
     @property
     def current_stack_offset(self):
-        for i, s in enumerate(self.stacks):
-            if self.group.current_window in s:
-                return i
-        return 0
+        entry = self.state.client_index.get(self.group.current_window)
+        if entry is None:
+            return 0
+        return self.stacks.index(entry[0])
 
     @property
     def clients(self):
@@ -76,8 +278,8 @@ class CustomStack(Layout):
     def clone(self, group):
         clone = Layout.clone(self, group)
         # These are mutable
-        clone.stacks = [_WinStack(autosplit=self.autosplit[i])
-                        for i in range(len(self.stacks))]
+        clone.state = _LayoutState()
+        clone.stats = _Stats()
         return clone
 
     # def _find_next(self, lst, offset):
@@ -89,23 +291,59 @@ class CustomStack(Layout):
     #             if i:
     #                 return i
 
+    def _autosplit(self, idx):
+        return idx < len(self.autosplit) and bool(self.autosplit[idx])
+
+    def _max_stacks(self):
+        if self.group is not None and self.group.screen is not None:
+            width = self.group.screen.width
+        elif self.state.plan_key is not None:
+            width = self.state.plan_key[3]
+        else:
+            return self.num_stacks
+        num_stacks = self.num_stacks
+        for min_width, n in sorted(self.stacks_by_width):
+            if width >= min_width:
+                num_stacks = n
+        return max(num_stacks, 1)
+
     def _append_stack(self):
         new_idx = len(self.stacks)
-        new_stack = _WinStack(autosplit=self.autosplit[new_idx])
-        if self.autosplit[new_idx]:
-            new_stack.split = True
+        new_stack = _WinStack(autosplit=self._autosplit(new_idx),
+                              index=self.state.client_index)
         self.stacks.append(new_stack)
 
     def _prepend_stack(self):
-        new_stack = _WinStack(autosplit=self.autosplit[0])
-        if self.autosplit[0]:
-            new_stack.split = True
+        new_stack = _WinStack(autosplit=self._autosplit(0),
+                              index=self.state.client_index)
         self.stacks.insert(0, new_stack)
 
+    def _merge_extra_stacks(self):
+        """Move the clients of the stacks beyond the maximum to the last one
+
+        That's needed when the group moves to a narrower screen, which allows
+        fewer stacks. The focused client stays focused.
+        """
+        max_stacks = self._max_stacks()
+        if len(self.stacks) <= max_stacks:
+            return
+        target = self.stacks[max_stacks - 1]
+        focused = self.group.current_window
+        for extra in self.stacks[max_stacks:]:
+            start = len(target)
+            target.clients.extend(extra.clients)
+            target._reindex(start)
+        del self.stacks[max_stacks:]
+        if len(self.stacks) == 1:
+            self.stacks[0].split = self._autosplit(0)
+        if focused in target:
+            target.focus(focused)
+        self._invalidate()
+
     def _delete_stack(self, stack):
         self.stacks.remove(stack)
         if len(self.stacks) == 1:
-            self.stacks[0].split = self.autosplit[0]
+            self.stacks[0].split = self._autosplit(0)
 
     def next_stack(self):
         current_offset = self.current_stack_offset
@@ -117,10 +355,14 @@ class CustomStack(Layout):
         if len(self.stacks) > 1 and current_offset > 0:
             self.group.focus(self.stacks[current_offset - 1].cw, True)
 
+    @_timed
     def focus(self, client):
-        for stack in self.stacks:
-            if client in stack:
-                stack.focus(client)
+        entry = self.state.client_index.get(client)
+        if entry is not None:
+            stack, pos = entry
+            if pos != stack.current_index:
+                stack.current_index = pos
+                self._invalidate()
 
     def focus_first(self):
         for stack in self.stacks:
@@ -133,37 +375,100 @@ class CustomStack(Layout):
                 return stack.focus_last()
 
     def focus_next(self, client):
-        iterator = iter(self.stacks)
-        for i in iterator:
-            if client in i:
-                next = i.focus_next(client)
-                if next:
-                    return next
-                break
-        else:
+        entry = self.state.client_index.get(client)
+        if entry is None:
             return
+        stack, pos = entry
+        next = stack[pos + 1]
+        if next:
+            return next
 
-        for i in iterator:
+        for i in self.stacks[self.stacks.index(stack) + 1:]:
             if i:
                 return i.focus_first()
 
     def focus_previous(self, client):
-        iterator = iter(reversed(self.stacks))
-        for i in iterator:
-            if client in i:
-                next = i.focus_previous(client)
-                if next:
-                    return next
-                break
-        else:
+        entry = self.state.client_index.get(client)
+        if entry is None:
             return
+        stack, pos = entry
+        if pos > 0:
+            return stack[pos - 1]
 
-        for i in iterator:
+        for i in reversed(self.stacks[:self.stacks.index(stack)]):
             if i:
                 return i.focus_last()
 
+    @property
+    def restoring(self):
+        return self.state.restore is not None
+
+    def snapshot(self):
+        """Return the stacks in a JSON serialisable form
+
+        Clients are saved by window id, so that the stacks can be rebuilt after
+        a restart with ``begin_restore`` and ``end_restore``.
+        """
+        return {
+            # [window ids, current index, split] of each stack
+            "stacks": [
+                [[c.window.wid for c in s.clients], s.current_index, s.split]
+                for s in self.stacks
+            ],
+            "current_stack": self.current_stack_offset if self.stacks else 0,
+        }
+
+    def begin_restore(self, snapshot):
+        """Hold the clients added from now on until ``end_restore``"""
+        self.state.restore = snapshot
+        self.state.restored = []
+
+    def end_restore(self):
+        """Rebuild the stacks of the snapshot in one go
+
+        Clients added since ``begin_restore`` which are not in the snapshot are
+        then added the usual way. Returns the current client of the saved
+        current stack, if it is still there.
+        """
+        snapshot = self.state.restore
+        if snapshot is None:
+            return None
+        clients = {c.window.wid: c for c in self.state.restored}
+        self.state.restore = None
+        self.state.restored = []
+
+        saved = snapshot["stacks"]
+        focus = None
+        if saved:
+            wids, current, _ = saved[min(snapshot["current_stack"],
+                                         len(saved) - 1)]
+            if wids:
+                focus = clients.get(wids[min(current, len(wids) - 1)])
+
+        for wids, current, split in saved[:self._max_stacks()]:
+            members = [clients.pop(wid) for wid in wids if wid in clients]
+            if not members:
+                continue
+            stack = _WinStack(index=self.state.client_index)
+            stack.clients = members
+            stack.current_index = current
+            stack.split = split
+            stack._reindex()
+            self.stacks.append(stack)
+        if len(self.stacks) == 1 and not self._autosplit(0):
+            self.stacks[0].split = False
+
+        for client in clients.values():
+            self.add(client)
+        self._invalidate()
+        return focus
+
+    @_timed
     def add(self, client):
-        if len(self.stacks) < 2:
+        if self.restoring:
+            self.state.restored.append(client)
+            return
+        if len(self.stacks) < self._max_stacks():
             self._append_stack()
             self.stacks[-1].add(client)
         else:
@@ -172,200 +477,370 @@ class CustomStack(Layout):
                 target.add(client)
             else:
                 self.current_stack.add(client)
+        self._invalidate()
 
+    @_timed
     def remove(self, client):
+        if self.restoring:
+            if client in self.state.restored:
+                self.state.restored.remove(client)
+            return None
+        self._invalidate()
+        self.state.applied.pop(client, None)
         current_stack = self.current_stack
-        for i, s in enumerate(self.stacks):
-            if client in s:
-                s.remove(client)
-                if not s:
-                    if len(self.stacks) == 1:
+        entry = self.state.client_index.get(client)
+        if entry is not None:
+            s = entry[0]
+            i = self.stacks.index(s)
+            s.remove(client)
+            if not s:
+                if len(self.stacks) == 1:
+                    self._delete_stack(s)
+                else:
+                    # the stack that would take up the space of the empty one
+                    if i + 1 < len(self.stacks):
+                        neighbour = self.stacks[i + 1]
+                    else:
+                        neighbour = self.stacks[i - 1]
+                    if len(neighbour) > 1 and neighbour.split:
+                        win = neighbour.cw
+                        neighbour.remove(win)
+                        s.add(win)
+                        return win
+                    else:
                         self._delete_stack(s)
-                    elif len(self.stacks) == 2:
-                        if len(self.stacks[not i]) > 1 and self.stacks[not i].split:
-                            win = self.stacks[not i].cw
-                            self.stacks[not i].remove(win)
-                            s.add(win)
-                            return win
-                        else:
-                            self._delete_stack(s)
-                break
         if current_stack.cw:
             return current_stack.cw
         elif self.stacks:
             return self.stacks[0].cw
 
-    def client_to_next(self):
-        if self.stacks:
-            win = self.current_stack.cw
-            if len(self.stacks) == 1:
-                if len(self.current_stack) > 1:
-                    self._append_stack()
-                    self.current_stack.remove(win)
-                    self.stacks[1].add(win)
-                    self.stacks[1].focus(win)
-            elif len(self.stacks) == 2 and self.current_stack_offset == 0:
-                if len(self.current_stack) > 1:
-                    self.current_stack.remove(win)
-                    self.stacks[1].add(win)
-                    self.stacks[1].focus(win)
-                else:
-                    self.current_stack.remove(win)
-                    self._delete_stack(self.stacks[0])
+    def _client_to_stack(self, offset):
+        """Send the current client to the stack at offset from the current one
+
+        A new stack is created at the edge to place the client if there is no
+        stack in that direction and the maximum number of stacks hasn't been
+        reached. A stack left empty is deleted.
+        """
+        if not self.stacks:
+            return
+        current_offset = self.current_stack_offset
+        current = self.stacks[current_offset]
+        win = current.cw
+        target_offset = current_offset + offset
+        if 0 <= target_offset < len(self.stacks):
+            target = self.stacks[target_offset]
+            current.remove(win)
+            if not current:
+                self._delete_stack(current)
+                if len(self.stacks) == 1:
                     self.stacks[0].split = False
-                    self.stacks[0].add(win)
-                    self.stacks[0].focus(win)
+        elif len(current) > 1 and len(self.stacks) < self._max_stacks():
+            if offset > 0:
+                self._append_stack()
+                target = self.stacks[-1]
+            else:
+                self._prepend_stack()
+                target = self.stacks[0]
+            current.remove(win)
+        else:
+            return
+        target.add(win)
+        target.focus(win)
+
+    def client_to_next(self):
+        self._invalidate()
+        self._client_to_stack(1)
 
     def client_to_previous(self):
+        self._invalidate()
+        self._client_to_stack(-1)
+
+    def _invalidate(self):
+        """Mark the cached layout plan as stale"""
+        self.state.version += 1
+
+    def _layout_plan(self, screen_rect):
+        """Return the placement of every client for the current state
+
+        The plan maps each client to a (x, y, width, height, border_width,
+        margin) tuple, or to None if the client must be hidden. It is computed
+        in a single pass over all stacks and reused by every configure call of
+        the same layout pass, until the layout state or the screen changes.
+        """
+        key = (self.state.version, screen_rect.x, screen_rect.y,
+               screen_rect.width, screen_rect.height)
+        if key == self.state.plan_key:
+            return self.state.plan
+
+        self.state.px_focus = self.group.qtile.color_pixel(self.border_focus)
+        self.state.px_normal = self.group.qtile.color_pixel(self.border_normal)
+
+        plan = {}
         if self.stacks:
-            win = self.current_stack.cw
-            if len(self.stacks) == 1:
-                if len(self.current_stack) > 1:
-                    self._prepend_stack()
-                    self.current_stack.remove(win)
-                    self.stacks[0].add(win)
-                    self.stacks[0].focus(win)
-            elif len(self.stacks) == 2 and self.current_stack_offset == 1:
-                if len(self.current_stack) > 1:
-                    self.current_stack.remove(win)
-                    self.stacks[0].add(win)
-                    self.stacks[0].focus(win)
+            if self.max_single and len(self.stacks) == 1:
+                border_width = 0
+                margin = 0
+            else:
+                border_width = self.border_width
+                margin = self.margin
+
+            num_stacks = len(self.stacks)
+            column_width = int(screen_rect.width / num_stacks)
+            for i, s in enumerate(self.stacks):
+                xoffset = screen_rect.x + i * column_width
+                window_width = column_width - 2 * border_width
+
+                # fix double margin
+                if num_stacks > 1:
+                    if i == 0:
+                        window_width += margin // 2
+                    elif i == num_stacks - 1:
+                        window_width += margin // 2
+                        xoffset -= margin // 2
+                    else:
+                        window_width += margin
+                        xoffset -= margin // 2
+
+                if s.split:
+                    column_height = int(screen_rect.height / len(s))
+                    for client_idx, client in enumerate(s):
+                        yoffset = screen_rect.y + client_idx * column_height
+                        row_height = column_height
+
+                        # fix double margin
+                        if client_idx == 0:
+                            if len(s) > 1:
+                                row_height += margin // 2
+                        elif client_idx == len(s) - 1:
+                            row_height += margin // 2
+                            yoffset -= margin // 2
+                        else:
+                            row_height += margin
+                            yoffset -= margin // 2
+
+                        plan[client] = (
+                            xoffset,
+                            yoffset,
+                            window_width,
+                            row_height - 2 * border_width,
+                            border_width,
+                            margin,
+                        )
                 else:
-                    self.current_stack.remove(win)
-                    self._delete_stack(self.stacks[1])
-                    self.stacks[0].split = False
-                    self.stacks[0].add(win)
-                    self.stacks[0].focus(win)
+                    current = s.cw
+                    for client in s:
+                        if client == current:
+                            plan[client] = (
+                                xoffset,
+                                screen_rect.y,
+                                window_width,
+                                screen_rect.height - 2 * border_width,
+                                border_width,
+                                margin,
+                            )
+                        else:
+                            plan[client] = None
 
+        self.state.plan = plan
+        self.state.plan_key = key
+        return plan
+
+    @_timed
     def configure(self, client, screen_rect):
-        for i, s in enumerate(self.stacks):
-            if client in s:
-                break
-        else:
-            client.hide()
+        placement = self._layout_plan(screen_rect).get(client)
+        applied = self.state.applied.get(client, False)
+
+        if placement is None:
+            if applied is None and client.hidden:
+                self.state.x_calls['skipped'] += 1
+            else:
+                client.hide()
+                self.state.applied[client] = None
+                self.state.x_calls['hide'] += 1
             return
 
         if client.has_focus:
-            px = self.group.qtile.color_pixel(self.border_focus)
+            px = self.state.px_focus
         else:
-            px = self.group.qtile.color_pixel(self.border_normal)
+            px = self.state.px_normal
 
-        if self.max_single and len(self.stacks) == 1:
-            border_width = 0
-            margin = 0
-        else:
-            border_width = self.border_width
-            margin = self.margin
-
-        column_width = int(screen_rect.width / len(self.stacks))
-        xoffset = screen_rect.x + i * column_width
-        window_width = column_width - 2 * border_width
-
-        # fix double margin
-        if len(self.stacks) == 2:
-            window_width += margin // 2
-            if i == 1:
-                xoffset -= margin // 2
-
-        if s.split:
-            client_idx = s.index(client)
-
-            column_height = int(screen_rect.height / len(s))
-            yoffset = screen_rect.y + client_idx * column_height
-
-            # fix double margin
-            if client_idx == 0:
-                if len(s) > 1:
-                    column_height += margin // 2
-            elif client_idx == len(s) - 1:
-                column_height += margin // 2
-                yoffset -= margin // 2
+        if applied and not client.hidden and applied[0] == placement:
+            # of the place and unhide calls, the border call replaces one
+            if applied[1] != px:
+                self._set_border(client, placement, px)
+                self.state.x_calls['skipped'] += 1
             else:
-                column_height += margin
-                yoffset -= margin // 2
-
-            window_height = column_height - 2 * border_width
-
-            client.place(
-                xoffset,
-                yoffset,
-                window_width,
-                window_height,
-                border_width,
-                px,
-                margin=margin,
-            )
-            client.unhide()
-        else:
-            if client == s.cw:
-                client.place(
-                    xoffset,
-                    screen_rect.y,
-                    window_width,
-                    screen_rect.height - 2 * border_width,
-                    border_width,
-                    px,
-                    margin=margin,
-                )
-                client.unhide()
+                self.state.x_calls['skipped'] += 2
+            return
+
+        x, y, width, height, border_width, margin = placement
+        client.place(x, y, width, height, border_width, px, margin=margin)
+        client.unhide()
+        self.state.applied[client] = (placement, px)
+        self.state.x_calls['place'] += 1
+        self.state.x_calls['unhide'] += 1
+
+    def _set_border(self, client, placement, px):
+        # only the border colour changed, no need to move the window
+        client.bordercolor = px
+        client.window.set_attribute(borderpixel=px)
+        self.state.applied[client] = (placement, px)
+        self.state.x_calls['border'] += 1
+
+    def can_refocus(self, client):
+        """Whether focusing client leaves all the clients where they are
+
+        That's the case when the client is already shown: it is either in a
+        split stack or the current client of its stack.
+        """
+        return bool(self.state.applied.get(client)) and not client.hidden
+
+    @_timed
+    def repaint_borders(self, *clients):
+        """Recolour the borders of clients after a focus change"""
+        for client in clients:
+            applied = self.state.applied.get(client)
+            if not applied or client.hidden:
+                continue
+            if client.has_focus:
+                px = self.state.px_focus
             else:
-                client.hide()
+                px = self.state.px_normal
+            if applied[1] != px:
+                self._set_border(client, applied[0], px)
+
+    def _request_layout(self):
+        """Lay out the group once the pending commands have been handled
+
+        Commands change the stacks right away but leave moving the windows to
+        a single layout pass, so that a burst of them, from key repeat or a
+        script, doesn't lay out the group once per command.
+        """
+        if self.state.relayout is not None:
+            return
+        qtile = self.group.qtile
+        delay = self.state.last_layout + self.layout_interval - time.monotonic()
+        if delay > 0:
+            self.state.relayout = qtile.call_later(delay, self._relayout)
+        else:
+            self.state.relayout = qtile.call_soon(self._relayout)
+
+    def _relayout(self):
+        self.state.relayout = None
+        if self.group.layout is self:
+            self.group.layout_all()
+
+    def layout(self, windows, screen_rect):
+        if self.restoring:
+            # end_restore will lay out all the clients at once
+            return
+        self._merge_extra_stacks()
+        if self.state.relayout is not None:
+            # this pass shows the changes of the pending commands already
+            self.state.relayout.cancel()
+            self.state.relayout = None
+        self.state.last_layout = time.monotonic()
+        if not self.instrument:
+            return Layout.layout(self, windows, screen_rect)
+        before = dict(self.x_calls)
+        start = time.perf_counter()
+        Layout.layout(self, windows, screen_rect)
+        self.stats.record("layout", time.perf_counter() - start)
+        self.stats.record_pass(before, self.x_calls)
+
+    def hide(self):
+        # windows are unmapped or handed over to another layout, forget what
+        # was applied to them
+        self.state.applied.clear()
 
     def info(self):
+        # only rebuilt when the stacks, the focus or a window title changed
+        key = (self.state.version, self.group.current_window, _name_changes)
+        if key == self.state.info_key:
+            return self._with_x_calls(self.state.info)
         d = Layout.info(self)
         d["stacks"] = [i.info() for i in self.stacks]
         d["current_stack"] = self.current_stack_offset
         d["clients"] = [c.name for c in self.clients]
+        self.state.info = d
+        self.state.info_key = key
+        return self._with_x_calls(d)
+
+    def _with_x_calls(self, info):
+        # a copy down to the lists, the cached info must not be changed by
+        # the callers
+        d = dict(info)
+        d["stacks"] = [dict(i, clients=list(i["clients"]))
+                       for i in info["stacks"]]
+        d["clients"] = list(info["clients"])
+        d["x_calls"] = dict(self.x_calls)
+        d["x_calls"]["issued"] = sum(self.x_calls[n] for n in _Stats.X_CALLS)
         return d
 
+    @_timed
     def cmd_toggle_split(self):
         """Toggle vertical split on the current stack"""
         if len(self.stacks) > 1:
             self.current_stack.toggle_split()
-            self.group.layout_all()
+            self._invalidate()
+            self._request_layout()
 
+    @_timed
     def cmd_down(self):
         """Switch to the next window in this stack"""
         self.current_stack.current_index += 1
+        self._invalidate()
         self.group.focus(self.current_stack.cw, False)
 
+    @_timed
     def cmd_up(self):
         """Switch to the previous window in this stack"""
         self.current_stack.current_index -= 1
+        self._invalidate()
         self.group.focus(self.current_stack.cw, False)
 
+    @_timed
     def cmd_shuffle_up(self):
         """Shuffle the order of this stack up"""
         self.current_stack.shuffle_up()
-        self.group.layout_all()
+        self._invalidate()
+        self._request_layout()
 
+    @_timed
     def cmd_shuffle_down(self):
         """Shuffle the order of this stack down"""
         self.current_stack.shuffle_down()
-        self.group.layout_all()
+        self._invalidate()
+        self._request_layout()
 
+    @_timed
     def cmd_rotate(self):
         """Rotate order of the stacks"""
         utils.shuffle_up(self.stacks)
-        self.group.layout_all()
+        self._invalidate()
+        self._request_layout()
 
+    @_timed
     def cmd_next(self):
         """Focus next stack"""
         return self.next_stack()
 
+    @_timed
     def cmd_previous(self):
         """Focus previous stack"""
         return self.previous_stack()
 
+    @_timed
     def cmd_client_to_next(self):
         """Send the current client to the next stack"""
         self.client_to_next()
-        self.group.layout_all()
+        self._request_layout()
 
+    @_timed
     def cmd_client_to_previous(self):
         """Send the current client to the previous stack"""
         self.client_to_previous()
-        self.group.layout_all()
+        self._request_layout()
 
     # def cmd_swap_main(self):
     #     if len(self.stacks) == 2:
@@ -380,3 +855,150 @@ class CustomStack(Layout):
 
     def cmd_info(self):
         return self.info()
+
+    def cmd_stats(self):
+        """Return call counts and timings of the layout operations
+
+        Only collected when the layout is created with ``instrument=True``.
+        Timings are given in milliseconds, with the 99th percentile computed
+        over the most recent calls.
+        """
+        d = self.stats.info()
+        d["instrument"] = self.instrument
+        d["x_calls"] = dict(self.x_calls)
+        return d
+
+    def cmd_reset_stats(self):
+        """Reset the statistics returned by the stats command"""
+        self.stats.reset()
+
+
+def save_state(groups, path):
+    """Save the stacks of the CustomStack layouts of groups to path"""
+    state = {}
+    for group in groups:
+        snapshots = {
+            layout.name: layout.snapshot() for layout in group.layouts
+            if isinstance(layout, CustomStack) and layout.stacks
+        }
+        if snapshots:
+            state[group.name] = snapshots
+    try:
+        with open(path, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+    except OSError:
+        logger.exception("Unable to save the stacks to %s", path)
+
+
+def begin_restore(groups, path):
+    """Load the stacks saved by save_state before the windows are managed
+
+    Until ``end_restore`` is called, the layouts with saved stacks only collect
+    the windows added to their group instead of laying them out one by one.
+    The state file is removed, so that it is only used once.
+    """
+    try:
+        with open(path) as f:
+            state = json.load(f)
+        os.remove(path)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError):
+        logger.exception("Unable to load the stacks from %s", path)
+        return
+    for group in groups:
+        snapshots = state.get(group.name, {})
+        for layout in group.layouts:
+            if isinstance(layout, CustomStack) and layout.name in snapshots:
+                layout.begin_restore(snapshots[layout.name])
+
+
+def end_restore(groups):
+    """Rebuild the stacks loaded by begin_restore, one layout pass per group"""
+    for group in groups:
+        restored = False
+        focus = None
+        for layout in group.layouts:
+            if isinstance(layout, CustomStack) and layout.restoring:
+                restored = True
+                client = layout.end_restore()
+                if layout is group.layout:
+                    focus = client
+        if not restored:
+            continue
+        if focus is not None and focus in group.windows:
+            group.focus(focus, warp=False)
+        else:
+            group.layout_all()
+
+
+def _is_tiled(layout, client):
+    return not client.floating and layout.can_refocus(client)
+
+
+def focus(group, client):
+    """Focus a client of group like group.focus, without a relayout if possible
+
+    When the client is shown by a CustomStack already, and so is the previous
+    focused client, only the borders of both are repainted. A floating window
+    losing the focus is left to group.focus, which repaints its border.
+
+    The other layouts of the group are told about the new focused client
+    without calling their ``focus``, which lays out the group again for the
+    layouts built on ``_SimpleLayoutBase`` like Max. Groups with layouts of
+    another kind are left to group.focus.
+    """
+    layout = group.layout
+    previous = group.current_window
+    if (not isinstance(layout, CustomStack) or
+            not _is_tiled(layout, client) or
+            (previous is not None and not _is_tiled(layout, previous)) or
+            not all(isinstance(each, (CustomStack, _SimpleLayoutBase))
+                    for each in group.layouts)):
+        group.focus(client, False)
+        return
+    group.current_window = client
+    group.floating_layout.blur()
+    for each in group.layouts:
+        if isinstance(each, CustomStack):
+            each.focus(client)
+        else:
+            each.clients.current_client = client
+    hook.fire("focus_change")
+    layout.repaint_borders(previous, client)
+    if group.screen is client.qtile.current_screen:
+        client.focus(False)
+
+
+class MouseFocus:
+    """Focus follows mouse, once the pointer settles on a window
+
+    This replaces qtile's follow_mouse_focus, which must be disabled. Instead
+    of focusing every window crossed by the pointer, the window under it is
+    focused when no other window has been entered for ``settle_time`` seconds,
+    through ``focus``.
+    """
+
+    def __init__(self, settle_time=0.05):
+        self.settle_time = settle_time
+        self._client = None
+        self._handle = None
+        hook.subscribe.client_mouse_enter(self._enter)
+
+    def _enter(self, client):
+        if self._handle is not None:
+            self._handle.cancel()
+        self._client = client
+        self._handle = client.qtile.call_later(self.settle_time, self._settle)
+
+    def _settle(self):
+        client, self._client = self._client, None
+        self._handle = None
+        group = client.group
+        qtile = client.qtile
+        if group is None or client not in group.windows or qtile._drag:
+            return
+        if group.current_window is not client:
+            focus(group, client)
+        if group.screen and qtile.current_screen != group.screen:
+            qtile.focus_screen(group.screen.index, False)
@@ -0,0 +1,113 @@
+import re
+
+import xcffib.xproto
+from libqtile import layout
+
+RULE_KEYS = ("wname", "wmclass", "role")
+
+
+def _inline_flags(regex):
+    # the flags of the expression itself, as opposed to those given to compile
+    return re.compile(regex.pattern).flags & ~re.compile(
+        regex.pattern[:0]
+    ).flags
+
+
+class FloatRules:
+    """Float rules compiled into hash sets and regular expressions
+
+    The rules are the dictionaries taken by ``Floating``, and a window matches
+    a rule if any of its keys matches, as in ``Window.match``. Besides strings,
+    which are compared exactly, values may be compiled regular expressions,
+    matched like in ``libqtile.config.Match``. The strings of all the rules are
+    gathered in one set per key, and the expressions in one alternation per
+    key and set of flags, so that matching a window takes about the same time
+    whatever the number of rules. Expressions with groups, which would be
+    numbered differently, or with global inline flags like ``(?i)``, which
+    must start the expression, are matched on their own.
+    """
+
+    def __init__(self, rules):
+        self.exact = {key: set() for key in RULE_KEYS}
+        self.patterns = {key: [] for key in RULE_KEYS}
+        patterns = {}
+        for rule in rules:
+            if not any(rule.values()):
+                raise TypeError(
+                    "Either a name, a wmclass or a role must be specified"
+                )
+            for key, value in rule.items():
+                if key not in RULE_KEYS:
+                    raise TypeError("Unknown float rule key: %s" % key)
+                if not value:
+                    continue
+                if isinstance(value, str):
+                    self.exact[key].add(value)
+                elif value.groups or _inline_flags(value):
+                    self.patterns[key].append(value)
+                else:
+                    patterns.setdefault((key, value.flags), []).append(
+                        value.pattern
+                    )
+        for (key, flags), sources in patterns.items():
+            self.patterns[key].append(re.compile(
+                "|".join("(?:%s)" % source for source in sources), flags
+            ))
+
+    @property
+    def uses_role(self):
+        return bool(self.exact["role"] or self.patterns["role"])
+
+    def match(self, wmclass, wname, role=None):
+        if wname in self.exact["wname"] or role in self.exact["role"]:
+            return True
+        if not self.exact["wmclass"].isdisjoint(wmclass):
+            return True
+        if wname and any(p.match(wname) for p in self.patterns["wname"]):
+            return True
+        if role and any(p.match(role) for p in self.patterns["role"]):
+            return True
+        return any(p.match(c) for p in self.patterns["wmclass"] for c in wmclass)
+
+
+class Floating(layout.Floating):
+    """Floating layout matching its float rules through a compiled index
+
+    The float rules are compiled once into a ``FloatRules`` index, and the
+    decision for each (wmclass, wname, role) seen is cached, so that bursts of
+    dialogs or notifications don't go through the rules again.
+    """
+
+    defaults = [
+        ("match_cache_size", 1024, "Maximum number of float decisions kept."),
+    ]
+
+    def __init__(self, float_rules=None, no_reposition_match=None, **config):
+        layout.Floating.__init__(self, float_rules, no_reposition_match,
+                                 **config)
+        self.add_defaults(Floating.defaults)
+        self.rules = FloatRules(self.float_rules)
+        self.decisions = {}
+
+    def match(self, win):
+        """Used to default float some windows"""
+        if win.window.get_wm_type() in self.auto_float_types:
+            return True
+        try:
+            wmclass = tuple(win.window.get_wm_class() or ())
+            if self.rules.uses_role:
+                role = win.window.get_wm_window_role()
+            else:
+                role = None
+        except (xcffib.xproto.WindowError, xcffib.xproto.AccessError):
+            wmclass = ()
+            role = None
+
+        key = (wmclass, win.name, role)
+        decision = self.decisions.get(key)
+        if decision is None:
+            if len(self.decisions) >= self.match_cache_size:
+                self.decisions.clear()
+            decision = self.rules.match(*key)
+            self.decisions[key] = decision
+        return decision
@@ -0,0 +1,129 @@
+import time
+
+from libqtile import bar
+from libqtile.drawer import TextLayout
+from libqtile.widget import base
+
+import startup_trace
+from custom_widgets import text_cache, timers
+
+
+class Bar(bar.Bar):
+    """A bar painting its widgets at most once per frame
+
+    Redraw requests, of the whole bar or of a single widget, only mark what
+    needs to be painted. The bar is then painted at most once every
+    ``frame_interval`` seconds: entirely if it was requested, otherwise only
+    the regions of the widgets marked dirty. The ``paint_stats`` command shows
+    how many paints were requested and how many were actually done.
+
+    Text widgets draw their text through the render cache shared by all the
+    bars, whose hit rate is shown by the ``text_cache_stats`` command. The
+    ``timer_stats`` command shows how often the timer of the widget updates
+    woke up.
+    """
+
+    defaults = [
+        ("frame_interval", 1 / 30, "Minimum time between two paints of the "
+                                   "bar, in seconds."),
+        ("cache_text", True, "Draw the text widgets through the shared text "
+                             "render cache."),
+    ]
+
+    def __init__(self, widgets, size, **config):
+        bar.Bar.__init__(self, widgets, size, **config)
+        self.add_defaults(Bar.defaults)
+        self._full_redraw = False
+        self._dirty = []
+        self._frame = None
+        self._last_paint = 0
+        self.paint_stats = dict.fromkeys(
+            ("requested", "frames", "full", "widgets"), 0
+        )
+
+    def _configure(self, qtile, screen):
+        with startup_trace.span('bar and widgets configure'):
+            bar.Bar._configure(self, qtile, screen)
+        # mirrors may have been created, catch the draws of all the widgets
+        for widget in self.widgets:
+            if "draw" not in widget.__dict__:
+                widget._paint = widget.draw
+                widget.draw = self._widget_draw(widget)
+            if (self.cache_text and isinstance(widget, base._TextBox) and
+                    type(widget.layout) is TextLayout):
+                text_cache.CachedTextLayout.replace(widget)
+
+    def finalize(self):
+        if self._frame is not None:
+            self._frame.cancel()
+            self._frame = None
+        bar.Bar.finalize(self)
+
+    def _widget_draw(self, widget):
+        def draw():
+            self.paint_stats["requested"] += 1
+            if widget not in self._dirty:
+                self._dirty.append(widget)
+            self._schedule()
+        return draw
+
+    def draw(self):
+        self.paint_stats["requested"] += 1
+        self._full_redraw = True
+        self._schedule()
+
+    def _schedule(self):
+        if self._frame is not None:
+            return
+        delay = self._last_paint + self.frame_interval - time.monotonic()
+        if delay > 0:
+            self._frame = self.qtile.call_later(delay, self._paint)
+        else:
+            self._frame = self.qtile.call_soon(self._paint)
+
+    def _paint(self):
+        self._frame = None
+        self._last_paint = time.monotonic()
+        self.paint_stats["frames"] += 1
+        if self.paint_stats["frames"] == 1:
+            startup_trace.mark('first paint')
+            startup_trace.write()
+        if self._full_redraw:
+            self.paint_stats["full"] += 1
+            self._full_redraw = False
+            self._dirty = []
+            self._resize(self.length, self.widgets)
+            for widget in self.widgets:
+                widget._paint()
+            if self.widgets:
+                end = widget.offset + widget.length
+                if end < self.length:
+                    if self.horizontal:
+                        self.drawer.draw(offsetx=end, width=self.length - end)
+                    else:
+                        self.drawer.draw(offsety=end,
+                                         height=self.length - end)
+        else:
+            dirty, self._dirty = self._dirty, []
+            for widget in dirty:
+                widget._paint()
+            self.paint_stats["widgets"] += len(dirty)
+
+    def info(self):
+        info = bar.Bar.info(self)
+        info["paint_stats"] = dict(self.paint_stats)
+        return info
+
+    def cmd_paint_stats(self):
+        """Return the numbers of requested and actual paints of the bar"""
+        stats = dict(self.paint_stats)
+        stats["saved"] = stats["requested"] - stats["full"] - stats["widgets"]
+        return stats
+
+    def cmd_text_cache_stats(self):
+        """Return the size and hit rate of the shared text render cache"""
+        return text_cache.cache.stats()
+
+    def cmd_timer_stats(self):
+        """Return the number of wakeups of the timer shared by the widgets"""
+        return timers.wheel.stats()
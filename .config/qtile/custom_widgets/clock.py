@@ -0,0 +1,55 @@
+import re
+
+from libqtile.widget import clock
+
+from custom_widgets import sources
+
+# directives showing seconds or less
+SECONDS_DIRECTIVES = re.compile(r'%[-_0^#]?[ScsTXrf]')
+
+
+def granularity(format):
+    """Return how often, in seconds, the text of a strftime format changes
+
+    Formats without seconds change on the minute, whatever the timezone,
+    larger units are not used as some timezones are not whole hours apart.
+    """
+    if SECONDS_DIRECTIVES.search(format.replace('%%', '')):
+        return 1
+    return 60
+
+
+class Clock(clock.Clock):
+    """A clock formatting the time of a shared ``sources.ClockSource``
+
+    The clock is updated as often as its format changes, every minute for
+    "%H:%M", or every ``update_interval`` seconds if that is longer. All the
+    clocks updated as often are woken up once, however many bars show them,
+    and only redraw when their text changes.
+    """
+
+    defaults = [
+        ("source", None, "ClockSource to show, by default the one shared by "
+                         "the clocks updated as often."),
+    ]
+
+    def __init__(self, **config):
+        clock.Clock.__init__(self, **config)
+        self.add_defaults(Clock.defaults)
+        if self.source is None:
+            self.source = sources.shared(
+                sources.ClockSource,
+                max(self.update_interval, granularity(self.format)),
+            )
+
+    def timer_setup(self):
+        self.source.subscribe(self._time_changed)
+
+    def finalize(self):
+        self.source.unsubscribe(self._time_changed)
+        clock.Clock.finalize(self)
+
+    def _time_changed(self, now):
+        if self.timezone:
+            now = now.astimezone(self.timezone)
+        self.update(now.strftime(self.format))
@@ -0,0 +1,52 @@
+from libqtile.widget import keyboardlayout
+
+from custom_widgets import sources
+
+
+class KeyboardLayout(keyboardlayout.KeyboardLayout):
+    """A keyboard layout widget showing a shared ``sources.KeyboardLayoutSource``
+
+    setxkbmap is run once per ``update_interval`` for all the widgets, without
+    blocking the event loop, instead of once per widget and bar.
+    """
+
+    defaults = [
+        ("source", None, "KeyboardLayoutSource to show, by default the one "
+                         "shared by the widgets with the same "
+                         "update_interval."),
+    ]
+
+    def __init__(self, **config):
+        keyboardlayout.KeyboardLayout.__init__(self, **config)
+        self.add_defaults(KeyboardLayout.defaults)
+        if self.source is None:
+            self.source = sources.shared(sources.KeyboardLayoutSource,
+                                         self.update_interval)
+
+    def timer_setup(self):
+        self.source.subscribe(self._layout_changed)
+
+    def finalize(self):
+        self.source.unsubscribe(self._layout_changed)
+        keyboardlayout.KeyboardLayout.finalize(self)
+
+    def _layout_changed(self, keyboard):
+        self.update(self.display_map.get(keyboard, keyboard.upper()))
+
+    def tick(self):
+        # shown when the source publishes it, don't query setxkbmap here
+        if self.source.value is not None:
+            self._layout_changed(self.source.value)
+
+    def next_keyboard(self):
+        current_keyboard = self.source.value
+        if current_keyboard in self.configured_keyboards:
+            # iterate the list circularly
+            next_keyboard = self.configured_keyboards[
+                (self.configured_keyboards.index(current_keyboard) + 1) %
+                len(self.configured_keyboards)]
+        else:
+            next_keyboard = self.configured_keyboards[0]
+
+        self.keyboard = next_keyboard
+        self.source.refresh()
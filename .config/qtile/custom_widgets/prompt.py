@@ -0,0 +1,255 @@
+import asyncio
+import bisect
+import json
+import os
+
+from libqtile.log_utils import logger
+from libqtile.widget import prompt
+
+from custom_widgets import sources
+
+
+class ExecutableIndex:
+    """Sorted index of the executables found in $PATH
+
+    The directories of $PATH are scanned once, in a thread, and only scanned
+    again when their modification time changes, which happens whenever an
+    executable is added, removed or renamed, so checking the index is up to
+    date takes one stat per directory. They are also scanned again when their
+    device or inode changes, as the Nix store paths a profile switches between
+    all have the same modification time. Prefix lookups are a bisection in the
+    sorted names. The number of launches of each command is kept in
+    ``counts_path`` so that the most used commands are completed first.
+    """
+
+    def __init__(self, counts_path=None, max_counts=500):
+        if counts_path is None:
+            data_home = os.environ.get(
+                'XDG_DATA_HOME', os.path.expanduser('~/.local/share')
+            )
+            counts_path = os.path.join(data_home, 'qtile',
+                                       'launch_counts.json')
+        self.counts_path = counts_path
+        self.max_counts = max_counts
+        # directory -> ((device, inode, mtime), executable names)
+        self.dirs = {}
+        self.names = []
+        self.paths = {}
+        self.counts = self._load_counts()
+        self._scan = None
+
+    def _load_counts(self):
+        try:
+            with open(self.counts_path) as f:
+                return {str(k): int(v) for k, v in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, AttributeError):
+            logger.warning("Unable to read the launch counts in %s",
+                           self.counts_path)
+            return {}
+
+    def record(self, command):
+        """Count one launch of command, a command line"""
+        words = command.split()
+        if not words or words[0] not in self.paths:
+            return
+        name = words[0]
+        self.counts[name] = self.counts.get(name, 0) + 1
+        if len(self.counts) > self.max_counts:
+            ranked = sorted(self.counts, key=self.counts.get, reverse=True)
+            self.counts = {n: self.counts[n] for n in ranked[:self.max_counts]}
+        try:
+            os.makedirs(os.path.dirname(self.counts_path), exist_ok=True)
+            with open(self.counts_path, 'w') as f:
+                json.dump(self.counts, f)
+        except OSError:
+            logger.warning("Unable to write the launch counts in %s",
+                           self.counts_path)
+
+    @staticmethod
+    def _path_dirs():
+        dirs = os.environ.get('PATH', prompt.CommandCompleter.DEFAULTPATH)
+        return [os.path.expanduser(d) for d in dirs.split(':') if d]
+
+    def _changed_dirs(self, dirs):
+        changed = {}
+        for d in dirs:
+            try:
+                st = os.stat(d)
+                version = (st.st_dev, st.st_ino, st.st_mtime_ns)
+            except OSError:
+                version = None
+            known = self.dirs.get(d)
+            if known is None or known[0] != version:
+                changed[d] = version
+        return changed
+
+    @staticmethod
+    def _executables(d):
+        names = set()
+        try:
+            with os.scandir(d) as entries:
+                for entry in entries:
+                    try:
+                        if (not entry.is_dir() and
+                                os.access(entry.path, os.X_OK)):
+                            names.add(entry.name)
+                    except OSError:
+                        pass
+        except OSError:
+            pass
+        return names
+
+    def _update(self, dirs, changed):
+        scanned = dict(self.dirs)
+        for d, version in changed.items():
+            scanned[d] = (version, self._executables(d))
+        paths = {}
+        # the first directory of $PATH providing a name wins, like in a shell
+        for d in reversed(dirs):
+            for name in scanned[d][1]:
+                paths[name] = os.path.join(d, name)
+        return scanned, sorted(paths), paths
+
+    def refresh(self, background=True):
+        """Scan the directories of $PATH that changed since the last scan
+
+        The scan is done in a thread unless ``background`` is False, in which
+        case the index is up to date on return.
+        """
+        if self._scan is not None and not self._scan.done():
+            if not background:
+                # the scan in progress may have missed the latest changes
+                self._scan.cancel()
+            else:
+                return
+        dirs = self._path_dirs()
+        changed = self._changed_dirs(dirs)
+        if not changed and set(dirs) == set(self.dirs):
+            return
+        if not background:
+            self._apply(dirs, self._update(dirs, changed))
+            return
+        loop = asyncio.get_event_loop()
+        self._scan = loop.run_in_executor(None, self._update, dirs, changed)
+        self._scan.add_done_callback(
+            lambda scan: scan.cancelled() or self._apply(dirs, scan.result())
+        )
+
+    def _apply(self, dirs, result):
+        scanned, self.names, self.paths = result
+        self.dirs = {d: scanned[d] for d in dirs}
+
+    def completions(self, prefix):
+        if not self.dirs:
+            # completing before the first scan finished
+            self.refresh(background=False)
+        ranked = sorted(
+            (n for n in self.counts
+             if n.startswith(prefix) and n in self.paths),
+            key=lambda n: (-self.counts[n], n),
+        )
+        lo = bisect.bisect_left(self.names, prefix)
+        hi = bisect.bisect_left(self.names, prefix + '\U0010ffff', lo)
+        return Completions(prefix, ranked, self.names, lo, hi, self.paths)
+
+
+class Completions:
+    """Completions of a prefix, cycled through one at a time
+
+    The most launched commands come first, then the other names of the index
+    in ``names[lo:hi]``, then the prefix itself. Each completion costs the
+    same whatever the number of matches, the matches aren't copied.
+    """
+
+    def __init__(self, prefix, ranked, names, lo, hi, paths):
+        self.prefix = prefix
+        self.ranked = ranked
+        self.skip = set(ranked)
+        self.names = names
+        self.lo = lo
+        self.hi = hi
+        self.paths = paths
+        self.position = -1
+
+    def next(self):
+        """Return the next (display value, actual value) pair"""
+        while True:
+            self.position += 1
+            ranked = len(self.ranked)
+            matches = self.hi - self.lo
+            if self.position < ranked:
+                name = self.ranked[self.position]
+            elif self.position < ranked + matches:
+                name = self.names[self.lo + self.position - ranked]
+                if name in self.skip:
+                    continue
+            elif self.position == ranked + matches:
+                return self.prefix, self.prefix
+            else:
+                self.position = -1
+                continue
+            return name, self.paths[name]
+
+
+class CommandCompleter(prompt.CommandCompleter):
+    """Command completer looking up an ``ExecutableIndex``
+
+    Paths, starting with ``~`` or ``/``, are completed like before.
+    """
+
+    def __init__(self, qtile, index, _testing=False):
+        prompt.CommandCompleter.__init__(self, qtile, _testing)
+        self.index = index
+
+    def complete(self, txt):
+        if txt and txt[0] in "~/":
+            return prompt.CommandCompleter.complete(self, txt)
+        if self.lookup is None:
+            self.lookup = self.index.completions(txt)
+        display, self.thisfinal = self.lookup.next()
+        return display
+
+
+class Prompt(prompt.Prompt):
+    """A prompt completing commands from a shared ``ExecutableIndex``
+
+    The index is built in the background when the widget is set up and
+    checked for changes each time a command is prompted, so tab completion
+    doesn't walk $PATH. Commands launched from the prompt are counted to rank
+    the completions.
+    """
+
+    defaults = [
+        ("launch_counts_path", None,
+         "File keeping the number of launches of each command. Defaults to "
+         "$XDG_DATA_HOME/qtile/launch_counts.json"),
+        ("index", None, "ExecutableIndex to complete commands from, by "
+                        "default the one shared by the prompts with the same "
+                        "launch_counts_path."),
+    ]
+
+    def __init__(self, **config):
+        prompt.Prompt.__init__(self, **config)
+        self.add_defaults(Prompt.defaults)
+        if self.index is None:
+            self.index = sources.shared(ExecutableIndex,
+                                        self.launch_counts_path)
+
+    def timer_setup(self):
+        self.index.refresh()
+
+    def start_input(self, prompt, callback, complete=None,
+                    strict_completer=False):
+        # the prompt argument hides the module
+        super().start_input(prompt, callback, complete, strict_completer)
+        if complete == "cmd":
+            self.index.refresh()
+            self.completer = CommandCompleter(self.qtile, self.index)
+
+    def _send_cmd(self):
+        launched = isinstance(self.completer, CommandCompleter)
+        prompt.Prompt._send_cmd(self)
+        if launched and self.user_input:
+            self.index.record(self.user_input)
@@ -0,0 +1,290 @@
+"""Data sources shared by the widgets of all the bars
+
+A source polls or subscribes to one metric, once, and pushes its value to
+every widget showing it, whatever the number of bars and screens. It starts
+with its first view and stops with its last one. ``shared`` returns the one
+source of a kind and settings, so that widgets built for each screen from
+the same config share it.
+"""
+
+import asyncio
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+from libqtile import hook
+from libqtile.log_utils import logger
+
+from custom_widgets import timers
+
+_shared = {}
+
+
+def shared(cls, *args):
+    """Return the source ``cls(*args)``, created on the first call"""
+    key = (cls, args)
+    if key not in _shared:
+        _shared[key] = cls(*args)
+    return _shared[key]
+
+
+class Source:
+    """A value pushed to the functions subscribed to it when it changes"""
+
+    def __init__(self):
+        self.value = None
+        self.views = []
+
+    def subscribe(self, callback):
+        self.views.append(callback)
+        if self.value is not None:
+            callback(self.value)
+        if len(self.views) == 1:
+            self.start()
+
+    def unsubscribe(self, callback):
+        if callback in self.views:
+            self.views.remove(callback)
+            if not self.views:
+                self.stop()
+
+    def publish(self, value):
+        if value == self.value:
+            return
+        self.value = value
+        self.notify()
+
+    def notify(self):
+        for callback in list(self.views):
+            callback(self.value)
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class PollSource(Source):
+    """A source calling ``poll`` on every multiple of ``interval`` seconds
+
+    ``poll`` is a coroutine, so that sources running a command don't block
+    the event loop. Its result is published unless it is None. The polls are
+    scheduled on the shared timer wheel, aligned on the clock so that sources
+    with compatible intervals wake up together.
+    """
+
+    def __init__(self, interval):
+        Source.__init__(self)
+        self.interval = interval
+        self._timer = None
+        self._task = None
+
+    def start(self):
+        self.refresh()
+        self._schedule()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _schedule(self):
+        self._timer = timers.wheel.call_at(
+            timers.next_multiple(self.interval), self._wake
+        )
+
+    def _wake(self):
+        self._schedule()
+        self.refresh()
+
+    def refresh(self):
+        """Poll again now, e.g. after changing what is polled"""
+        self._task = asyncio.ensure_future(self._refresh())
+
+    async def _refresh(self):
+        try:
+            value = await self.poll()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("%s failed to poll", type(self).__name__)
+            return
+        if value is not None:
+            self.publish(value)
+
+    async def poll(self):
+        return None
+
+
+class ClockSource(PollSource):
+    """The current time, as an aware datetime, on every multiple of interval
+
+    Views format it themselves, in their own timezone and format.
+    """
+
+    # the wheel may wake up slightly early, don't show the previous second
+    DELTA = timedelta(seconds=0.5)
+
+    def __init__(self, interval=1):
+        PollSource.__init__(self, interval)
+
+    async def poll(self):
+        return datetime.now(timezone.utc).astimezone() + self.DELTA
+
+
+kb_layout_regex = re.compile(r'layout:\s+(?P<layout>\w+)')
+kb_variant_regex = re.compile(r'variant:\s+(?P<variant>\w+)')
+
+
+class KeyboardLayoutSource(PollSource):
+    """The keyboard layout reported by setxkbmap, e.g. "us" or "us intl" """
+
+    def __init__(self, interval=1):
+        PollSource.__init__(self, interval)
+
+    async def poll(self):
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                'setxkbmap', '-verbose', '10', '-query',
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except OSError as e:
+            logger.error("Please, check that setxkbmap is available: %s", e)
+            self.stop()
+            return None
+        output = (await proc.communicate())[0].decode()
+        if proc.returncode:
+            logger.error("Can not get the keyboard layout")
+            return "unknown"
+        match_layout = kb_layout_regex.search(output)
+        if match_layout is None:
+            return 'ERR'
+        keyboard = match_layout.group('layout')
+        match_variant = kb_variant_regex.search(output)
+        if match_variant:
+            keyboard += " " + match_variant.group('variant')
+        return keyboard
+
+
+class WindowNameSource(Source):
+    """Notified when the name or state of the shown windows may have changed
+
+    There is no value to share, each view shows the window of its own screen,
+    but the hooks are subscribed once for all the views.
+    """
+
+    HOOKS = ("client_name_updated", "focus_change", "float_change",
+             "current_screen_change")
+
+    def start(self):
+        for name in self.HOOKS:
+            getattr(hook.subscribe, name)(self._changed)
+
+    def stop(self):
+        for name in self.HOOKS:
+            getattr(hook.unsubscribe, name)(self._changed)
+
+    def _changed(self, *args):
+        self.notify()
+
+
+class VolumeSource(Source):
+    """The (volume, muted) state of the default sink
+
+    A connection to the volctl daemon is kept open and the daemon pushes the
+    cached sink state whenever it changes. The daemon is started by the
+    autostart supervisor, its socket is waited for up to ``daemon_timeout``
+    seconds. If it doesn't show up, a long-lived ``pactl subscribe`` child is
+    used and ``query``, a function returning the volume or -1 when muted, is
+    called when a sink change event arrives.
+    """
+
+    def __init__(self, socket_path=None, reconnect_delay=1, daemon_timeout=5):
+        Source.__init__(self)
+        if socket_path is None:
+            runtime_dir = os.environ.get('XDG_RUNTIME_DIR', '/tmp')
+            socket_path = os.path.join(runtime_dir, 'volctl.sock')
+        self.socket_path = socket_path
+        self.reconnect_delay = reconnect_delay
+        self.daemon_timeout = daemon_timeout
+        self.query = None
+        self._watcher = None
+
+    def start(self):
+        self._watcher = asyncio.ensure_future(self._watch())
+
+    def stop(self):
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+    async def _watch(self):
+        deadline = time.monotonic() + self.daemon_timeout
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(
+                    self.socket_path
+                )
+            except OSError:
+                if time.monotonic() < deadline:
+                    # the daemon may still be starting along with qtile
+                    await asyncio.sleep(0.1)
+                    continue
+                await self._watch_pactl()
+                return
+
+            writer.write(b"watch\n")
+            async for line in reader:
+                try:
+                    # the microphone state may follow, not shared here
+                    volume, muted = line.decode().split()[:2]
+                    self.publish((int(volume), muted == 'yes'))
+                except ValueError:
+                    logger.warning("Unexpected volctl output: %r", line)
+            writer.close()
+            await asyncio.sleep(self.reconnect_delay)
+            # the supervisor restarts it, wait for it again
+            deadline = time.monotonic() + self.daemon_timeout
+
+    def update(self):
+        if self.query is None:
+            return
+        volume = self.query()
+        self.publish((0, True) if volume < 0 else (volume, False))
+
+    async def _watch_pactl(self):
+        self.update()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                'pactl', 'subscribe',
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except OSError:
+            logger.error("Neither volctl nor pactl are available, "
+                         "volume widgets won't be updated")
+            return
+
+        refresh_pending = False
+
+        def refresh():
+            nonlocal refresh_pending
+            refresh_pending = False
+            self.update()
+
+        loop = asyncio.get_event_loop()
+        try:
+            async for line in proc.stdout:
+                # one event per channel may arrive, refresh once for all
+                if b"on sink " in line and not refresh_pending:
+                    refresh_pending = True
+                    loop.call_later(0.02, refresh)
+        finally:
+            if proc.returncode is None:
+                proc.terminate()
@@ -0,0 +1,197 @@
+"""Render cache for the text of the bar widgets
+
+Text widgets lay out their text with Pango and render it every time they are
+drawn. ``CachedTextLayout`` instead renders each text once into an image
+surface, kept in a ``TextCache`` shared by all the bars, and then paints that
+surface, so that window titles or clock texts coming back cost a blit instead
+of a new Pango layout.
+"""
+
+from collections import OrderedDict
+
+import cairocffi
+from libqtile import pangocffi, utils
+from libqtile.drawer import TextLayout
+
+
+class TextCache:
+    """Least recently used text surfaces, up to ``max_bytes`` of pixels"""
+
+    def __init__(self, max_bytes=8 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        surface = entry[0]
+        if surface is not None:
+            self.size += surface.get_stride() * surface.get_height()
+        self.entries[key] = entry
+        while self.size > self.max_bytes and len(self.entries) > 1:
+            _, (surface, _, _) = self.entries.popitem(last=False)
+            if surface is not None:
+                # may still be drawn by a layout, left to be garbage collected
+                self.size -= surface.get_stride() * surface.get_height()
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return dict(
+            entries=len(self.entries),
+            bytes=self.size,
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            hit_rate=self.hits / lookups if lookups else None,
+        )
+
+
+cache = TextCache()
+
+
+class CachedTextLayout(TextLayout):
+    """A TextLayout drawing and measuring its text through a ``TextCache``
+
+    The Pango layout is only updated when the text isn't in the cache. Text
+    drawn with a gradient depends on where it is drawn, and isn't cached.
+    """
+
+    def __init__(self, drawer, text, colour, font_family, font_size,
+                 font_shadow, wrap=True, markup=False, cache=cache):
+        self.cache = cache
+        self._text = None
+        self._laid_out = None
+        self._font = (font_family, font_size)
+        # key and entry of the current text
+        self._current = (None, None)
+        TextLayout.__init__(self, drawer, text, colour, font_family,
+                            font_size, font_shadow, wrap, markup)
+
+    @classmethod
+    def replace(cls, widget, cache=cache):
+        """Swap the layout of a configured _TextBox for a cached one"""
+        old = widget.layout
+        widget.layout = cls(
+            widget.drawer, widget.formatted_text, widget.foreground,
+            widget.font, widget.fontsize, widget.fontshadow,
+            markup=widget.markup, cache=cache,
+        )
+        old.finalize()
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, value):
+        self._text = value
+
+    def _lay_out(self):
+        if self._laid_out != self._text:
+            TextLayout.text.fset(self, self._text)
+            self._laid_out = self._text
+
+    def _key(self):
+        colour = self.colour
+        if isinstance(colour, list):
+            if len(colour) > 1:
+                return None
+            colour = tuple(colour)
+        return (self._font, colour, self.font_shadow, self.markup,
+                self._text, self._width)
+
+    def _entry(self):
+        """Return the (surface, width, height) of the text"""
+        key = self._key()
+        if key is not None and key == self._current[0]:
+            return self._current[1]
+        entry = None if key is None else self.cache.get(key)
+        if entry is None:
+            self._lay_out()
+            width, height = self.layout.get_pixel_size()
+            surface = None if key is None else self._render(width, height)
+            entry = (surface, width, height)
+            if key is not None:
+                self.cache.put(key, entry)
+        self._current = (key, entry)
+        return entry
+
+    def _render(self, width, height):
+        # a layout given a width, like GroupBox's, aligns its text in it, the
+        # text may then start further right than its own width
+        width = max(self._width or 0, width)
+        # clipped to the drawer like text drawn directly
+        width = min(width, self.drawer.width) + 1
+        surface = cairocffi.ImageSurface(cairocffi.FORMAT_ARGB32, width,
+                                         height + 1)
+        ctx = pangocffi.patch_cairo_context(cairocffi.Context(surface))
+        colour = self.colour
+        if isinstance(colour, list):
+            colour = colour[0] if colour else "#000000"
+        if self.font_shadow is not None:
+            ctx.set_source_rgba(*utils.rgb(self.font_shadow))
+            ctx.move_to(1, 1)
+            ctx.show_layout(self.layout)
+        ctx.set_source_rgba(*utils.rgb(colour))
+        ctx.move_to(0, 0)
+        ctx.show_layout(self.layout)
+        return surface
+
+    @property
+    def width(self):
+        if self._width is not None:
+            return self._width
+        return self._entry()[1]
+
+    @width.setter
+    def width(self, value):
+        TextLayout.width.fset(self, value)
+
+    @width.deleter
+    def width(self):
+        TextLayout.width.fdel(self)
+
+    @property
+    def height(self):
+        return self._entry()[2]
+
+    @property
+    def font_family(self):
+        return TextLayout.font_family.fget(self)
+
+    @font_family.setter
+    def font_family(self, font):
+        TextLayout.font_family.fset(self, font)
+        self._font = (font, self._font[1])
+
+    @property
+    def font_size(self):
+        return TextLayout.font_size.fget(self)
+
+    @font_size.setter
+    def font_size(self, size):
+        TextLayout.font_size.fset(self, size)
+        self._font = (self._font[0], size)
+
+    def draw(self, x, y):
+        surface = self._entry()[0]
+        if surface is None:
+            self._lay_out()
+            TextLayout.draw(self, x, y)
+            return
+        ctx = self.drawer.ctx
+        ctx.set_source_surface(surface, x, y)
+        ctx.rectangle(x, y, surface.get_width(), surface.get_height())
+        ctx.fill()
@@ -0,0 +1,115 @@
+"""One timer for all the periodic updates of the bars
+
+Instead of each widget or source keeping its own timer, callbacks are
+scheduled on ``wheel``, which rounds their time up to its ``tick`` and wakes
+up once for all the callbacks falling in the same tick. Periodic updates are
+aligned on multiples of their interval, so that e.g. a poll every 10 seconds
+and a clock ticking every minute share their wakeup at the top of the minute.
+The number of wakeups is counted, to check how often the bars wake the CPU.
+
+Times are wall clock times, but the event loop sleeps on the monotonic clock,
+which stops during a suspend and doesn't follow a clock step. The wheel
+checks the wall clock again at least every ``max_sleep`` seconds, so after a
+resume or a step its callbacks are late by at most that much.
+"""
+
+import asyncio
+import math
+import time
+
+from libqtile.log_utils import logger
+
+
+def next_multiple(interval):
+    """Return the next time.time() which is a multiple of interval"""
+    return (math.floor(time.time() / interval) + 1) * interval
+
+
+class Timer:
+    def __init__(self, wheel, slot, callback):
+        self.wheel = wheel
+        self.slot = slot
+        self.callback = callback
+
+    def cancel(self):
+        self.wheel._cancel(self)
+
+
+class TimerWheel:
+    """Call functions at given times, batched by ``tick`` seconds
+
+    The wheel never sleeps more than ``max_sleep`` seconds in a row, waking up
+    to check the wall clock when nothing is due sooner.
+    """
+
+    def __init__(self, tick=0.1, max_sleep=2):
+        self.tick = tick
+        self.max_sleep = max_sleep
+        # slot -> timers due at slot * tick
+        self.slots = {}
+        self._handle = None
+        self._armed = None
+        self.started = time.monotonic()
+        self.wakeups = 0
+        self.calls = 0
+
+    def call_at(self, when, callback):
+        """Call callback at when, a time.time() value, rounded up to a tick"""
+        slot = math.ceil(when / self.tick)
+        timer = Timer(self, slot, callback)
+        self.slots.setdefault(slot, []).append(timer)
+        if self._armed is None or slot < self._armed:
+            self._arm(slot)
+        return timer
+
+    def call_later(self, delay, callback):
+        return self.call_at(time.time() + delay, callback)
+
+    def _arm(self, slot):
+        if self._handle is not None:
+            self._handle.cancel()
+        self._armed = slot
+        delay = min(max(0, slot * self.tick - time.time()), self.max_sleep)
+        self._handle = asyncio.get_event_loop().call_later(delay, self._wake)
+
+    def _cancel(self, timer):
+        timers = self.slots.get(timer.slot)
+        if timers is None or timer not in timers:
+            return
+        timers.remove(timer)
+        if timers:
+            return
+        del self.slots[timer.slot]
+        if timer.slot == self._armed:
+            # don't wake up for nothing
+            self._handle.cancel()
+            self._handle = self._armed = None
+            if self.slots:
+                self._arm(min(self.slots))
+
+    def _wake(self):
+        self._handle = self._armed = None
+        self.wakeups += 1
+        # woken up a bit early, the current slot is still due
+        now = math.ceil(time.time() / self.tick)
+        for slot in sorted(s for s in self.slots if s <= now):
+            for timer in self.slots.pop(slot):
+                self.calls += 1
+                try:
+                    timer.callback()
+                except Exception:
+                    logger.exception("Timer callback %r failed", timer.callback)
+        if self.slots and self._armed is None:
+            self._arm(min(self.slots))
+
+    def stats(self):
+        minutes = (time.monotonic() - self.started) / 60
+        return dict(
+            wakeups=self.wakeups,
+            calls=self.calls,
+            pending=sum(len(timers) for timers in self.slots.values()),
+            wakeups_per_minute=self.wakeups / minutes if minutes else None,
+        )
+
+
+wheel = TimerWheel()
@@ -0,0 +1,61 @@
+from libqtile.widget import volume
+
+from custom_widgets import sources
+
+
+class Volume(volume.Volume):
+    """A volume widget that redraws only when the sink state changes
+
+    Instead of polling the mixer every ``update_interval`` seconds, this widget
+    is pushed the sink volume and mute state by a ``sources.VolumeSource``,
+    which keeps one connection to the volctl daemon open for all the volume
+    widgets of all the bars, so a volume key press is shown right away without
+    querying pactl again. If volctl is not available, the source falls back to
+    a single long-lived ``pactl subscribe`` child and only queries the mixer
+    when a sink change event arrives.
+    """
+
+    defaults = [
+        ("socket_path", None, "Path of the volctl daemon socket. Defaults "
+                              "to $XDG_RUNTIME_DIR/volctl.sock."),
+        ("reconnect_delay", 1, "Seconds to wait before reconnecting to the "
+                               "daemon after losing it."),
+        ("daemon_timeout", 5, "Seconds to wait for the daemon socket before "
+                              "falling back to pactl."),
+        ("source", None, "VolumeSource to show, by default the one shared by "
+                         "the widgets with the same settings."),
+    ]
+
+    def __init__(self, **config):
+        volume.Volume.__init__(self, **config)
+        self.add_defaults(Volume.defaults)
+        if self.source is None:
+            self.source = sources.shared(
+                sources.VolumeSource, self.socket_path, self.reconnect_delay,
+                self.daemon_timeout,
+            )
+
+    def timer_setup(self):
+        if self.theme_path:
+            self.setup_images()
+        if self.source.query is None:
+            self.source.query = self.get_volume
+        self.source.subscribe(self._state_changed)
+
+    def finalize(self):
+        self.source.unsubscribe(self._state_changed)
+        volume.Volume.finalize(self)
+
+    def _state_changed(self, state):
+        self.set_state(*state)
+
+    def set_state(self, volume, muted):
+        vol = -1 if muted else volume
+        if vol != self.volume:
+            self.volume = vol
+            self._update_drawer()
+            self.bar.draw()
+
+    def update(self):
+        # one-off refresh, no rescheduling
+        self.source.update()
@@ -0,0 +1,54 @@
+from libqtile import pangocffi
+from libqtile.widget import base, windowname
+
+from custom_widgets import sources
+
+
+class WindowName(windowname.WindowName):
+    """A window name widget notified through a shared ``sources.WindowNameSource``
+
+    The hooks are subscribed once for all the widgets instead of once per
+    widget, and a widget only redraws when its text changes.
+    """
+
+    defaults = [
+        ("source", None, "WindowNameSource notifying the widget, by default "
+                         "the shared one."),
+    ]
+
+    def __init__(self, **config):
+        windowname.WindowName.__init__(self, **config)
+        self.add_defaults(WindowName.defaults)
+        if self.source is None:
+            self.source = sources.shared(sources.WindowNameSource)
+
+    def _configure(self, qtile, bar):
+        # skip WindowName._configure, which subscribes to the hooks
+        base._TextBox._configure(self, qtile, bar)
+
+    def timer_setup(self):
+        self.source.subscribe(self.update)
+        self.update()
+
+    def finalize(self):
+        self.source.unsubscribe(self.update)
+        windowname.WindowName.finalize(self)
+
+    def update(self, *args):
+        if self.for_current_screen:
+            w = self.qtile.current_screen.group.current_window
+        else:
+            w = self.bar.screen.group.current_window
+        state = ''
+        if self.show_state and w is not None:
+            if w.maximized:
+                state = '[] '
+            elif w.minimized:
+                state = '_ '
+            elif w.floating:
+                state = 'V '
+        unescaped = "%s%s" % (state, w.name if w and w.name else " ")
+        text = pangocffi.markup_escape_text(unescaped)
+        if text != self.text:
+            self.text = text
+            self.bar.draw()
@@ -0,0 +1,102 @@
+import time
+
+from libqtile import hook
+from libqtile.log_utils import logger
+
+
+def rss(pid):
+    """Return the resident memory of a process in MiB, 0 if it is gone"""
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+class SpawnPool:
+    """Keep a few windows of an application ready to be shown
+
+    The pool spawns ``size`` instances of ``command`` in advance and parks
+    their windows, unmapped, in ``group``, which should be a ScratchPad so that
+    it is never shown. ``claim`` moves one of them to the current group, where
+    the layout adds it like any new window, and the pool is refilled in the
+    background. If the pool is empty, the command is spawned as usual.
+
+    Windows are recognised by the pid of the spawned process only, so that
+    the windows the user opens meanwhile are left alone. Applications opening
+    their windows from an already running process, like Firefox, can't be
+    pooled. ``wm_class`` lets the pool take back its idle windows after a
+    restart. No instance is added to the pool while its idle ones use more
+    than ``max_idle_rss`` MiB of memory.
+    """
+
+    def __init__(self, command, size=1, group='pool', wm_class=None,
+                 max_idle_rss=None, spawn_timeout=30):
+        self.command = command
+        self.size = size
+        self.group = group
+        self.wm_class = wm_class
+        self.max_idle_rss = max_idle_rss
+        self.spawn_timeout = spawn_timeout
+        self.idle = []
+        # pid -> time of the spawns whose window hasn't appeared yet
+        self.pending = {}
+        hook.subscribe.client_new(self._client_new)
+        hook.subscribe.client_killed(self._client_killed)
+
+    def claim(self, qtile):
+        while self.idle:
+            client = self.idle.pop(0)
+            if client.window.wid in qtile.windows_map:
+                client.togroup(qtile.current_group.name)
+                break
+        else:
+            qtile.cmd_spawn(self.command)
+        qtile.call_soon(self.fill, qtile)
+
+    def fill(self, qtile):
+        now = time.monotonic()
+        self.pending = {
+            pid: spawned for pid, spawned in self.pending.items()
+            if now - spawned < self.spawn_timeout
+        }
+        missing = self.size - len(self.idle) - len(self.pending)
+        if missing <= 0:
+            return
+        if self.max_idle_rss is not None:
+            pids = {client.window.get_net_wm_pid() for client in self.idle}
+            idle_rss = sum(rss(pid) for pid in pids if pid)
+            if idle_rss >= self.max_idle_rss:
+                logger.info("spawn pool: %s idle instances use %d MiB, not "
+                            "refilling", self.command, idle_rss)
+                return
+        for _ in range(missing):
+            self.pending[qtile.cmd_spawn(self.command)] = now
+
+    def _matches_class(self, client):
+        if self.wm_class is None:
+            return False
+        return self.wm_class in (client.window.get_wm_class() or ())
+
+    def _client_new(self, client):
+        pid = client.window.get_net_wm_pid()
+        if pid in self.pending:
+            del self.pending[pid]
+        elif (client.group is not None and client.group.name == self.group and
+                self._matches_class(client)):
+            # idle window left in the pool group by a restart
+            if len(self.idle) >= self.size:
+                client.togroup()
+                return
+        else:
+            return
+        client.togroup(self.group)
+        self.idle.append(client)
+
+    def _client_killed(self, client):
+        if client in self.idle:
+            self.idle.remove(client)
+            client.qtile.call_soon(self.fill, client.qtile)
@@ -0,0 +1,96 @@
+"""Timeline of qtile's startup
+
+Spans and instant events recorded while qtile starts are written to ``path``
+in the Chrome trace event format, which can be opened in chrome://tracing or
+https://ui.perfetto.dev to see where the startup time goes. When qtile is
+restarted from the config, the time of the restart request is passed to the
+new process in the environment and starts the timeline.
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager
+
+from libqtile.log_utils import logger
+
+path = os.path.join(os.environ.get('XDG_RUNTIME_DIR', '/tmp'),
+                    'qtile-startup-trace.json')
+
+RESTART_VARIABLE = 'QTILE_RESTART_TIME'
+
+# (name, start, duration or None for instant events)
+events = []
+_open = {}
+
+
+def now():
+    # boot time clock, comparable across the exec of a restart
+    return time.clock_gettime(time.CLOCK_BOOTTIME)
+
+
+def mark(name, at=None):
+    events.append((name, now() if at is None else at, None))
+
+
+def begin(name):
+    _open[name] = now()
+
+
+def end(name):
+    start = _open.pop(name)
+    events.append((name, start, now() - start))
+
+
+@contextmanager
+def span(name):
+    begin(name)
+    try:
+        yield
+    finally:
+        end(name)
+
+
+def mark_restart(at=None):
+    """Pass the time of the restart request to the next qtile process
+
+    Only call it right before restarting: the variable is set in qtile's own
+    environment, and inherited by everything qtile spawns.
+    """
+    os.environ[RESTART_VARIABLE] = repr(now() if at is None else at)
+
+
+def restart_time():
+    try:
+        return float(os.environ.pop(RESTART_VARIABLE))
+    except (KeyError, ValueError):
+        return None
+
+
+def write():
+    if not events:
+        return
+    timeline = sorted(events, key=lambda e: e[1])
+    origin = timeline[0][1]
+    pid = os.getpid()
+    trace = []
+    for name, start, duration in timeline:
+        event = dict(name=name, pid=pid, tid=0, ts=(start - origin) * 1e6)
+        if duration is None:
+            event.update(ph='i', s='g')
+        else:
+            event.update(ph='X', dur=duration * 1e6)
+        trace.append(event)
+    try:
+        with open(path, 'w') as f:
+            json.dump(dict(traceEvents=trace, displayTimeUnit='ms'), f)
+    except OSError:
+        logger.exception("Unable to write the startup trace to %s", path)
+        return
+    finished = max(start + (duration or 0) for _, start, duration in timeline)
+    logger.info("startup trace: %.3fs, written to %s", finished - origin, path)
+
+
+restarted = restart_time()
+if restarted is not None:
+    mark('restart requested', restarted)
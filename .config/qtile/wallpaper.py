@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import mmap
+import os
+
+import cairocffi
+import cairocffi.pixbuf
+import cairocffi.xcb
+import xcffib.xproto
+from libqtile import config
+from libqtile.log_utils import logger
+
+FORMAT = cairocffi.FORMAT_RGB24
+
+
+class WallpaperCache:
+    """Wallpapers scaled to the size of the screens, kept on disk
+
+    Each wallpaper is decoded and scaled once per (file, modification time,
+    screen size, mode) and the pixels stored raw in ``cache_dir``. They are
+    then memory mapped and painted as they are, so that restarting qtile, or
+    plugging a screen of a size seen before, doesn't decode or scale any
+    image. Files scaled for an older version of a wallpaper are removed.
+    """
+
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            cache_home = os.environ.get(
+                'XDG_CACHE_HOME', os.path.expanduser('~/.cache')
+            )
+            cache_dir = os.path.join(cache_home, 'qtile', 'wallpapers')
+        self.cache_dir = cache_dir
+        # (path, mtime, width, height, mode) -> mapped surface
+        self.surfaces = {}
+        self._decoded = None
+
+    def surface(self, path, width, height, mode=None):
+        """Return an image surface of the wallpaper scaled for the screen"""
+        mtime = os.stat(path).st_mtime_ns
+        key = (path, mtime, width, height, mode)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            return surface
+        name = hashlib.sha1(
+            repr((path, width, height, mode)).encode()
+        ).hexdigest()
+        cached = os.path.join(self.cache_dir, '%s-%d.raw' % (name, mtime))
+        surface = self._load(cached, width, height)
+        if surface is None:
+            self._store(cached, self._scale(path, mtime, width, height, mode))
+            self._remove_stale(name, cached)
+            surface = self._load(cached, width, height)
+        # forget the older versions of the wallpaper at that size
+        self.surfaces = {
+            k: s for k, s in self.surfaces.items()
+            if (k[0],) + k[2:] != (path, width, height, mode)
+        }
+        self.surfaces[key] = surface
+        return surface
+
+    @staticmethod
+    def _load(cached, width, height):
+        stride = cairocffi.ImageSurface.format_stride_for_width(FORMAT, width)
+        try:
+            with open(cached, 'rb') as f:
+                if os.fstat(f.fileno()).st_size != stride * height:
+                    return None
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        except OSError:
+            return None
+        return cairocffi.ImageSurface.create_for_data(
+            data, FORMAT, width, height, stride
+        )
+
+    def _store(self, cached, surface):
+        surface.flush()
+        tmp = cached + '.tmp'
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(tmp, 'wb') as f:
+            f.write(surface.get_data())
+        os.replace(tmp, cached)
+
+    def _remove_stale(self, name, cached):
+        for entry in os.listdir(self.cache_dir):
+            if entry.startswith(name + '-') and entry != os.path.basename(cached):
+                try:
+                    os.remove(os.path.join(self.cache_dir, entry))
+                except OSError:
+                    pass
+
+    def _decode(self, path, mtime):
+        # decoded once for all the screens configured in a row
+        if self._decoded is None or self._decoded[0] != (path, mtime):
+            with open(path, 'rb') as f:
+                image, _ = cairocffi.pixbuf.decode_to_image_surface(f.read())
+            self._decoded = ((path, mtime), image)
+            asyncio.get_event_loop().call_soon(self._forget_decoded)
+        return self._decoded[1]
+
+    def _forget_decoded(self):
+        self._decoded = None
+
+    def _scale(self, path, mtime, width, height, mode):
+        image = self._decode(path, mtime)
+        image_w = image.get_width()
+        image_h = image.get_height()
+        surface = cairocffi.ImageSurface(FORMAT, width, height)
+        context = cairocffi.Context(surface)
+        if mode == 'fill':
+            # cover the screen, centred, like feh --bg-fill
+            ratio = max(width / image_w, height / image_h)
+            context.translate((width - image_w * ratio) / 2,
+                              (height - image_h * ratio) / 2)
+            context.scale(ratio)
+        elif mode == 'stretch':
+            context.scale(width / image_w, height / image_h)
+        context.set_source_surface(image)
+        context.paint()
+        return surface
+
+
+cache = WallpaperCache()
+
+
+def _root_pixmap(painter, width, height):
+    """Return the root pixmap, created if missing or of the wrong size
+
+    Returns a (pixmap, replaced) pair, where replaced is the previous root
+    pixmap to free once the new one is set, if any.
+    """
+    conn = painter.conn
+    root = painter.default_screen.root
+    replaced = None
+    for name in ('_XROOTPMAP_ID', 'ESETROOT_PMAP_ID'):
+        pixmap = root.get_property(name, xcffib.xproto.Atom.PIXMAP, int)
+        if pixmap:
+            try:
+                geometry = conn.core.GetGeometry(pixmap[0]).reply()
+            except xcffib.xproto.DrawableError:
+                continue
+            if (geometry.width, geometry.height) == (width, height):
+                return pixmap[0], replaced
+            replaced = pixmap[0]
+    pixmap = conn.generate_id()
+    conn.core.CreatePixmap(painter.default_screen.root_depth, pixmap,
+                           root.wid, width, height)
+    return pixmap, replaced
+
+
+def paint(painter, screens):
+    """Paint the wallpapers of screens from the cache, in one go
+
+    ``screens`` are (x, y, width, height, path, mode) tuples and ``painter`` is
+    qtile's ``libqtile.backend.x11.xcbq.Painter``. Unlike the painter, this
+    follows the size of the root window when screens are added or removed.
+    """
+    placements = []
+    for x, y, width, height, path, mode in screens:
+        try:
+            surface = cache.surface(path, width, height, mode)
+        except (OSError, cairocffi.pixbuf.ImageLoadingError) as e:
+            logger.error('Wallpaper: %s', e)
+            continue
+        placements.append((x, y, surface))
+    if not placements:
+        return
+
+    conn = painter.conn
+    screen = painter.default_screen
+    root = screen.root
+    geometry = conn.core.GetGeometry(root.wid).reply()
+    width, height = geometry.width, geometry.height
+    pixmap, replaced = _root_pixmap(painter, width, height)
+
+    for depth in screen.allowed_depths:
+        for visual in depth.visuals:
+            if visual.visual_id == screen.root_visual:
+                root_visual = visual
+                break
+    surface = cairocffi.xcb.XCBSurface(conn, pixmap, root_visual, width,
+                                       height)
+    context = cairocffi.Context(surface)
+    for x, y, image in placements:
+        context.set_source_surface(image, x, y)
+        context.rectangle(x, y, image.get_width(), image.get_height())
+        context.fill()
+    surface.flush()
+
+    for name in ('_XROOTPMAP_ID', 'ESETROOT_PMAP_ID'):
+        conn.core.ChangeProperty(
+            xcffib.xproto.PropMode.Replace, root.wid, painter.atoms[name],
+            xcffib.xproto.Atom.PIXMAP, 32, 1, [pixmap]
+        )
+    conn.core.ChangeWindowAttributes(root.wid, xcffib.xproto.CW.BackPixmap,
+                                     [pixmap])
+    if replaced is not None:
+        # of the size of the previous screen layout, nothing refers to it now
+        conn.core.FreePixmap(replaced)
+    conn.core.ClearArea(0, root.wid, 0, 0, width, height)
+    conn.flush()
+
+
+# screens waiting to be painted together, see Screen.paint
+_pending = []
+
+
+def _paint_pending(painter):
+    screens = list(_pending)
+    del _pending[:]
+    paint(painter, screens)
+
+
+class Screen(config.Screen):
+    """A screen painting its wallpaper through the wallpaper cache
+
+    ``wallpaper`` and ``wallpaper_mode`` are used as with qtile's Screen, but
+    the image isn't decoded and scaled again each time qtile starts. The
+    screens configured in a row are painted together.
+    """
+
+    def paint(self, path, mode=None):
+        if not _pending:
+            asyncio.get_event_loop().call_soon(_paint_pending,
+                                               self.qtile.core.painter)
+        _pending.append((self.x, self.y, self.width, self.height, path, mode))